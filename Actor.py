@@ -9,6 +9,8 @@ from MapItem import MapItem
 
 
 class Actor(MapItem):
+    __slots__ = ('controller', 'fighter', 'breath', 'descriptor', 'inventory', 'faction', 'map', 'location', 'layer')
+
     def __init__(self,
                  image_source='Chassis.png',
                  controller=None, fighter=None, descriptor=None,
@@ -22,8 +24,7 @@ class Actor(MapItem):
         self.attach_controller(controller)
         self.fighter = fighter
         self.breath = breath
-        if descriptor:
-            self.descriptor = descriptor
+        self.descriptor = descriptor
         self.inventory = inventory
         for a in (self.fighter, self.inventory, self.controller, self.descriptor, self.breath):
             if a:
@@ -36,6 +37,21 @@ class Actor(MapItem):
         self.widget = None
         self.map = None
         self.location = None
+        self.layer = None
+
+    def clone(self):
+        """
+        Return a copy of this actor with copies of its components. Faction component is shared
+        :return: Actor
+        """
+        r = super(Actor, self).clone()
+        for name in ('controller', 'fighter', 'descriptor', 'inventory', 'breath'):
+            component = getattr(self, name)
+            if component is not None:
+                component = component.clone()
+                component.actor = r
+                setattr(r, name, component)
+        return r
 
     def connect_to_map(self, map=None, layer=None, location=(None, None)):
         """
@@ -122,7 +138,9 @@ class Actor(MapItem):
             moved = True
             self.map.game_events.append(GameEvent(event_type='moved',
                                                   actor=self))
-            self.widget.last_move_animated = False
+            #  Widget may be absent if the game runs without interface (eg during replay)
+            if self.widget:
+                self.widget.last_move_animated = False
         return moved or collision_occured
 
     def jump(self, location=(None, None)):
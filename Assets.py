@@ -0,0 +1,71 @@
+"""
+Deferred asset loading.
+Sounds are not needed to draw the first frame, but loading them takes a while: SoundLoader reads a file only when
+it's first used, so every sound has to be loaded and seeked to avoid a lag when it's played for the first time.
+AssetLoader does that after the first frame is shown, one asset per frame, and calls back when all of them are
+ready. Loading is spread over frames instead of being done in a thread, because SDL audio and GL objects should
+only be created in the main thread.
+Textures and fonts are still loaded before the first frame, since the first frame can't be drawn without them.
+"""
+
+from collections import deque
+from time import perf_counter
+
+from kivy.clock import Clock
+
+
+class AssetLoader(object):
+    """
+    A queue of assets that are loaded one per frame after self.start() is called.
+    Loaded assets are kept in self.assets by name; an asset that is not loaded yet is simply missing from there,
+    so the users should be ready to do without it.
+    """
+    def __init__(self):
+        self.assets = {}
+        self.ready = False
+        #  Time spent loading, in seconds
+        self.load_time = 0
+        #  (name, loader) tuples waiting to be loaded
+        self._queue = deque()
+        self._callbacks = []
+
+    def add(self, name, loader):
+        """
+        Add an asset to the queue
+        :param name: str. The asset will be stored as self.assets[name]
+        :param loader: callable that takes no arguments and returns the asset
+        :return:
+        """
+        self._queue.append((name, loader))
+        self.ready = False
+
+    def start(self, on_ready=None):
+        """
+        Start loading queued assets, beginning with the next frame.
+        on_ready(loader) is called when all of them are loaded, or right away if there is nothing to load
+        :param on_ready: callable or None
+        :return:
+        """
+        if on_ready:
+            self._callbacks.append(on_ready)
+        if self._queue:
+            Clock.schedule_once(self._load_next, 0)
+        else:
+            self._finish()
+
+    def _load_next(self, dt):
+        name, loader = self._queue.popleft()
+        start = perf_counter()
+        self.assets[name] = loader()
+        self.load_time += perf_counter() - start
+        if self._queue:
+            Clock.schedule_once(self._load_next, 0)
+        else:
+            self._finish()
+
+    def _finish(self):
+        self.ready = True
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback in callbacks:
+            callback(self)
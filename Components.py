@@ -2,25 +2,43 @@
 Component classes that add various functionality to Actors and Constructions
 """
 
-from random import choice
-
 from GameEvent import GameEvent
 from Items import Item
+from MapItem import get_slots
+from RandomStreams import get_stream
 
 
 class Component(object):
     """
     Base class for components.
     Currently only defines actor attribute.
+    Components are slotted, like map items, to keep memory down on maps with lots of actors. Subclasses
+    should declare their own attributes in __slots__
     """
+    __slots__ = ('actor',)
+
     def __init__(self):
         self.actor = None
 
+    def clone(self):
+        """
+        Return a copy of this component that is not attached to any actor.
+        Used by MapItem.clone(); slot values are copied as is
+        :return:
+        """
+        r = object.__new__(type(self))
+        for name in get_slots(type(self)):
+            setattr(r, name, getattr(self, name))
+        r.actor = None
+        return r
+
 
 class FighterComponent(Component):
     """
     The component that provides the actor with combat capabilities
     """
+    __slots__ = ('max_hp', '_hp', 'attacks', 'defenses', 'ranged_attacks', 'max_ammo', '_ammo')
+
     def __init__(self, max_hp=5, attacks=(1, 2, 3), ranged_attacks=(0, 1, 2), defenses=(0, 0, 1),
                  ammo=5, max_ammo=5, **kwargs):
         super(FighterComponent, self).__init__(**kwargs)
@@ -94,19 +112,21 @@ class FighterComponent(Component):
                                                     actor=self.actor))
 
     def attack(self):
-        return choice(self.attacks)
+        return get_stream('combat').choice(self.attacks)
 
     def defense(self):
-        return choice(self.defenses)
+        return get_stream('combat').choice(self.defenses)
 
     def ranged_attack(self):
-        return choice(self.ranged_attacks)
+        return get_stream('combat').choice(self.ranged_attacks)
 
 
 class DescriptorComponent(Component):
     """
     The component that contains various displayable data about this actor
     """
+    __slots__ = ('name', 'description')
+
     def __init__(self, name='Unnamed actor', description='', **kwargs):
         super(DescriptorComponent, self).__init__(**kwargs)
         self.name = name
@@ -136,6 +156,8 @@ class InventoryComponent(Component):
     """
     Component that allows Actor to carry stuff
     """
+    __slots__ = ('volume', 'items')
+
     def __init__(self, volume=10, initial_items=[], **kwargs):
         super(InventoryComponent, self).__init__(**kwargs)
         self.volume = volume  #  Inventories of more than ten slots not supported by the interface
@@ -150,6 +172,17 @@ class InventoryComponent(Component):
     def __getitem__(self, item):
         return self.items[item]
 
+    def clone(self):
+        """
+        Return a copy of this inventory, with copies of all its items
+        :return:
+        """
+        r = super(InventoryComponent, self).clone()
+        r.items = [item.clone() for item in self.items]
+        for item in r.items:
+            item.owner = r
+        return r
+
     def append(self, item):
         """
         Add a single item to the inventory
@@ -207,6 +240,8 @@ class FactionComponent(Component):
     faction do not attack each other (and maybe even help, if they are able),
     and there may be interparty peace treaties and allies and stuff
     """
+    __slots__ = ('faction', 'enemies', 'allies')
+
     def __init__(self, faction=None, enemies=[], allies=[], **kwargs):
         super(FactionComponent, self).__init__(**kwargs)
         self.faction = faction
@@ -242,6 +277,8 @@ class BreathComponent(Component):
     and stores breath at any particular moment. Currently little more than a placeholder, but later may
     be expanded.
     """
+    __slots__ = ('breath', 'skill_costs')
+
     def __init__(self, **kwargs):
         super(BreathComponent, self).__init__(**kwargs)
         self.breath = 0
@@ -15,6 +15,9 @@ class Construction(MapItem):
     Base constructor class. Registers fighter, descriptor, controller and inventory components, if such are
     provided to constructor. Pretty similar to Actor.
     """
+    __slots__ = ('allow_entrance', 'fighter', 'descriptor', 'inventory', 'controller', 'faction',
+                 'map', 'location', 'layer')
+
     def __init__(self,
                  image_source='DownStairs.png',
                  fighter=None,
@@ -43,6 +46,20 @@ class Construction(MapItem):
         self.location = None
         self.layer = None
 
+    def clone(self):
+        """
+        Return a copy of this construction with copies of its components. Faction component is shared
+        :return: Construction
+        """
+        r = super(Construction, self).clone()
+        for name in ('controller', 'fighter', 'descriptor', 'inventory'):
+            component = getattr(self, name)
+            if component is not None:
+                component = component.clone()
+                component.actor = r
+                setattr(r, name, component)
+        return r
+
     def connect_to_map(self, layer='constructions', map=None, location=None):
         """
         Remember own position on map (and map itself)
@@ -79,6 +96,8 @@ class FighterConstruction(Construction):
     """
     Melee fighter construction. Supports 'move' method to enable melee combat
     """
+    __slots__ = ()
+
     def make_turn(self):
         self.controller.choose_actor_action()
         self.controller.call_actor_method()
@@ -115,7 +134,8 @@ class FighterConstruction(Construction):
             self.map.game_events.append(GameEvent(event_type='moved',
                                                   actor=self))
             moved = True
-            self.widget.last_move_animated = False
+            if self.widget:
+                self.widget.last_move_animated = False
         return moved or collision_occured
 
     def pause(self):
@@ -126,6 +146,8 @@ class ShooterConstruction(FighterConstruction):
     """
     Expanded fighter construction that is also able to shoot if it has ammo
     """
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(ShooterConstruction, self).__init__(*args, **kwargs)
 
@@ -157,6 +179,8 @@ class Trap(Construction):
     A construction that acts if an Actor steps on it.
     Currently is a hardcoded landmine (deals 5 damage to everything on its tile and neighbours)
     """
+    __slots__ = ('effect', 'primed', '_destroyed_items')
+
     def __init__(self, effect=None, **kwargs):
         super(Trap, self).__init__(**kwargs)
         self.effect = effect
@@ -186,6 +210,8 @@ class Spawner(Construction):
     """
     A construction that spawns enemies every few turns
     """
+    __slots__ = ('spawn_frequency', 'spawn_counter', 'spawn_factory')
+
     def __init__(self, spawn_frequency=5, spawn_factory=None, **kwargs):
         super(Spawner, self).__init__(**kwargs)
         self.spawn_frequency = spawn_frequency
@@ -215,6 +241,8 @@ class Upgrader(Construction):
     If at this construction's turn there is a Chassis of the same faction standing on top of it,
     if removes said Chassis and spawns a unit on top of it
     """
+    __slots__ = ('spawn_factory',)
+
     def __init__(self, spawn_factory=None, *args, **kwargs):
         super(Upgrader, self).__init__(*args, **kwargs)
         self.spawn_factory = spawn_factory
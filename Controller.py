@@ -1,7 +1,8 @@
 """
 Controllers, ie MapItem components that control actors' and constructions' behaviour
 """
-import random
+from RandomStreams import get_stream
+
 
 class Command(object):
     """
@@ -30,6 +31,16 @@ class Controller(object):
         self.last_command = None
         self.actor = None
 
+    def clone(self):
+        """
+        Return a copy of this controller that is not attached to any actor
+        :return:
+        """
+        r = object.__new__(type(self))
+        r.__dict__.update(self.__dict__)
+        r.actor = None
+        return r
+
     def call_actor_method(self):
         if not self.actor:
             raise AttributeError('Controller cannot be used when not attached to actor')
@@ -203,7 +214,7 @@ class MeleeAIController(AIController):
                 elif value == minimum and self.should_walk(n):
                     candidates.append(n)
         try:
-            target = random.choice(tuple(filter(lambda a: self.should_walk(a), candidates)))
+            target = get_stream('ai').choice(tuple(filter(lambda a: self.should_walk(a), candidates)))
             self.last_command = Command(command_type='walk',
                                     command_value=(target[0]-self.actor.location[0],
                                                    target[1]-self.actor.location[1]))
@@ -254,7 +265,7 @@ class FighterSpawnController(Controller):
         neighbours = self.actor.map.get_neighbours(layers=['actors', 'constructions'], location=self.actor.location)
         neighbours = list(filter(self._should_attack, neighbours))
         if len(neighbours) > 0:
-            victim = random.choice(neighbours)
+            victim = get_stream('ai').choice(neighbours)
             self.last_command = Command(command_type='walk',
                                         command_value=(victim.location[0]-self.actor.location[0],
                                                        victim.location[1]-self.actor.location[1]))
@@ -270,7 +281,7 @@ class ShooterSpawnController(Controller):
         neighbours = self.actor.map.get_neighbours(layers=['actors', 'constructions'], location=self.actor.location)
         neighbours = list(filter(self._should_attack, neighbours))
         if len(neighbours) > 0:
-            victim = random.choice(neighbours)
+            victim = get_stream('ai').choice(neighbours)
             self.last_command = Command(command_type='walk',
                                         command_value=(victim.location[0]-self.actor.location[0],
                                                        victim.location[1]-self.actor.location[1]))
@@ -1,12 +1,9 @@
 """
 Various factories, generating functions and other things.
-Creates both Widgets and MapItems
+Creates MapItems and loads maps. Doesn't depend on kivy, so that the game can be simulated headless; widgets
+are created by WidgetFactories
 """
 
-from kivy.graphics.transformation import Matrix
-from kivy.uix.image import Image
-from kivy.uix.scatter import Scatter
-
 #  Importing my own stuff
 from Map import RLMap
 from MapItem import GroundTile, MapItem
@@ -16,100 +13,54 @@ from Components import *
 from Controller import PlayerController, MeleeAIController, FighterSpawnController,\
     ShooterSpawnController, RangedAIController
 from Items import PotionTypeItem, Item, FighterTargetedEffect, TileTargetedEffect
+from RandomStreams import get_stream, get_seed, seed_streams
+from LevelCache import cache_filename, read_cache, write_cache, read_compiled_lines
+from MapResidency import MapResidency
 
 #  Other imports
-from random import choice, randint
-
-#  I don't remember why exactly there even are three different classes for tile widgets, but I get a feeling
-#  that refactoring it will break something somewhere
-
-
-class MapItemWidget(Scatter):
-    """
-    The actor widget that contains an actor image. It's a scatter to allow scaling.
-    """
-    def __init__(self, source='PC.png', **kwargs):
-        super(MapItemWidget, self).__init__(**kwargs)
-        self.direction = 'right'
-        self.img = Image(source=source, size=(32, 32), allow_stretch=False)
-        self.add_widget(self.img)
-        self.bind(size=self.update_img)
-
-    def flip(self):
-        """
-        Flip widget horizontally
-        :return:
-        """
-        self.apply_transform(Matrix().scale(-1, 1, 1),
-                             anchor=self.center)
-        if self.direction == 'right':
-            self.direction = 'left'
-        else:
-            self.direction = 'right'
-
-    def update_img(self, a, b):
-        #  Needs to be updated manually, as Scatter does not automatically affect its children sizes
-        #  positions work out themselves, though
-        self.img.size = self.size
-
-
-class TileWidgetFactory(object):
-    def __init__(self):
-        # The dictionary that implements dispatching correct methods for any MapItem class
-        self.type_methods = {GroundTile: self.create_tile_widget,
-                             Actor: self.create_actor_widget,
-                             Item: self.create_item_widget,
-                             Construction: self.create_construction_widget}
-        self.passable_tiles = ('Tile_passable.png', )
-
-    def create_widget(self, item):
-        """
-        Create a MapItem widget.
-        Calls the correct method of self depending on what the class of MapItem is
-        :param item:
-        :return:
-        """
-        assert isinstance(item, MapItem)
-        for t in self.type_methods.keys():
-            if isinstance(item, t):
-                return self.type_methods[t](item)
-
-    def create_tile_widget(self, tile):
-        #  There is no true randomness now, because the tiles are simple white bg.
-        #  When aesthetics get implemented, some floors, underground piping, etc. will be added
-        s = choice(self.passable_tiles) if tile.passable else 'Tile_impassable.png'
-        tile.widget = MapItemWidget(source=s, size=(32, 32),
-                                    size_hint=(None, None),
-                                    do_rotation=False, do_translation=False)
-        return tile.widget
-
-    #  These three methods are similar, but I'll retain three different methods in case something changes about them
-    def create_actor_widget(self, actor):
-        s = actor.image_source
-        widget = MapItemWidget(source=s, size=(32, 32),
-                               size_hint=(None, None),
-                               #  Better not allow multitouch transformations
-                               do_rotation=False, do_translation=False)
-        actor.widget = widget
-        return widget
-
-    def create_item_widget(self, item):
-        s = item.image_source
-        item.widget = MapItemWidget(source=s, size=(32, 32),
-                                 size_hint=(None, None))
-        return item.widget
-
-    def create_construction_widget(self, constr):
-        constr.widget = MapItemWidget(source=constr.image_source, size=(32, 32),
-                                           size_hint=(None, None))
-        return constr.widget
+from bisect import bisect_left
+from functools import partial
 
 
 class MapItemDepot:
     """
     A class that contains definitions of every item that can be placed on map during map generation.
     Every make_* method returns the instance of object in question.
+    Units and inventory items, which are created in large numbers, are not built from scratch every time. The first
+    one is built as a prototype and the rest are its clones (see MapItem.clone()). Units are defined declaratively
+    in self.unit_templates. Faction components are never changed, so there is only one of each.
+    There is a single depot shared by everything, Factories.depot
     """
+    #  {faction name: FactionComponent}
+    factions = {'pc': FactionComponent(faction='pc', enemies=['npc']),
+                'npc': FactionComponent(faction='npc', enemies=['pc']),
+                'decorations': FactionComponent(faction='decorations')}
+    #  Unit archetypes. Controller is a (class, kwargs) tuple, other components are dicts of their constructor
+    #  arguments. Every unit also gets a random inventory item
+    unit_templates = {'chassis': {'image_source': 'Chassis.png',
+                                  'controller': (MeleeAIController, {'dijkstra_weights': {'PC': 1,
+                                                                                          'upgraders': 1.5}}),
+                                  'fighter': {'max_hp': 3, 'ammo': 0, 'max_ammo': 0},
+                                  'descriptor': {'name': 'An empty chassis',
+                                                 'description': 'The chassis on which weapons or tools could be installed.'},
+                                  'inventory': {'volume': 1},
+                                  'faction': 'npc'},
+                      #  An upgraded Chassis that gets three shots but only 1 HP
+                      'gunner': {'image_source': 'GunnerChassis.png',
+                                 'controller': (RangedAIController, {}),
+                                 'fighter': {'max_hp': 1, 'ammo': 3, 'max_ammo': 3},
+                                 'descriptor': {'name': 'Gunner',
+                                                'description': 'A short-range gunner assembly.'},
+                                 'inventory': {'volume': 1},
+                                 'faction': 'npc'},
+                      #  An upgraded Chassis with 7 HP
+                      'melee': {'image_source': 'Melee.png',
+                                'controller': (MeleeAIController, {}),
+                                'fighter': {'max_hp': 7},
+                                'descriptor': {'name': 'Thug',
+                                               'description': 'A chassis protected by primitive armor'},
+                                'inventory': {'volume': 1},
+                                'faction': 'npc'}}
 
     def __init__(self):
         self.item_methods = [self.make_landmine,
@@ -140,23 +91,88 @@ class MapItemDepot:
                               'F': self.make_flag,
                               '.': self.make_passable_tile,
                               '~': self.make_impassable_tile}
+        #  Name of the RandomStreams stream used for random items
+        self.random_stream = 'spawn'
+        #  {name: MapItem} prototypes to be cloned
+        self.prototypes = {}
+
+    def get_prototype(self, name, constructor):
+        """
+        Return a prototype, building it on the first call
+        :param name: str
+        :param constructor: callable that returns a new MapItem
+        :return: MapItem
+        """
+        try:
+            return self.prototypes[name]
+        except KeyError:
+            self.prototypes[name] = constructor()
+            return self.prototypes[name]
+
+    def _build_unit(self, template):
+        """
+        Create a unit from its template
+        :param template: dict, one of self.unit_templates values
+        :return: Actor
+        """
+        controller_class, controller_kwargs = template['controller']
+        return Actor(image_source=template['image_source'],
+                     controller=controller_class(**controller_kwargs),
+                     fighter=FighterComponent(**template['fighter']),
+                     descriptor=DescriptorComponent(**template['descriptor']),
+                     inventory=InventoryComponent(**template['inventory']),
+                     faction=self.factions[template['faction']])
+
+    def make_unit(self, name):
+        """
+        Create a unit by cloning the prototype of a given archetype, and give it a random item
+        :param name: str, a key of self.unit_templates
+        :return: Actor
+        """
+        unit = self.get_prototype(name, lambda: self._build_unit(self.unit_templates[name])).clone()
+        #  Not via InventoryComponent.append(), which reports the change to the unit's map, and the unit
+        #  isn't on any map yet
+        item = self.make_random_item()
+        item.owner = unit.inventory
+        unit.inventory.items.append(item)
+        return unit
+
+    #  Shared instances of items that are the same in every cell, see MapItem.shared. {name: MapItem}
+    flyweights = {}
+
+    @classmethod
+    def get_flyweight(cls, name, constructor):
+        """
+        Return a shared item, creating it on the first call.
+        Shared items should never be changed after creation
+        :param name: str
+        :param constructor: callable that returns a new MapItem
+        :return: MapItem
+        """
+        try:
+            return cls.flyweights[name]
+        except KeyError:
+            item = constructor()
+            item.shared = True
+            cls.flyweights[name] = item
+            return item
 
     #  Simple single-item methods
-    @staticmethod
-    def make_passable_tile():
+    @classmethod
+    def make_passable_tile(cls):
         """
-        A simple passable tile
+        A simple passable tile. Shared by all cells
         :return:
         """
-        return GroundTile(passable=True, air_passable=True)
+        return cls.get_flyweight('passable_tile', lambda: GroundTile(passable=True, air_passable=True))
 
-    @staticmethod
-    def make_impassable_tile():
+    @classmethod
+    def make_impassable_tile(cls):
         """
-        Impassable water tile
+        Impassable water tile. Shared by all cells
         :return:
         """
-        return GroundTile(passable=False, air_passable=True)
+        return cls.get_flyweight('impassable_tile', lambda: GroundTile(passable=False, air_passable=True))
 
     def make_pc(self):
         """
@@ -167,19 +183,19 @@ class MapItemDepot:
                      controller=PlayerController(),
                      fighter=FighterComponent(max_hp=10),
                      inventory=InventoryComponent(volume=10, initial_items=self.get_all_items()),
-                     faction=FactionComponent(faction='pc', enemies=['npc']),
+                     faction=MapItemDepot.factions['pc'],
                      descriptor=DescriptorComponent(name='PC', description='Player character'),
                      breath=BreathComponent())
 
-    @staticmethod
-    def make_tree():
+    @classmethod
+    def make_tree(cls):
         """
-        Impassable wall
+        Impassable wall. Shared by all cells, because trees cannot be destroyed
         :return:
         """
-        return Construction(image_source='Tree.png', passable=False,
-                            descriptor=DescriptorComponent(name='Tree'),
-                            faction=FactionComponent(faction='decorations'))
+        return cls.get_flyweight('tree', lambda: Construction(image_source='Tree.png', passable=False,
+                                                              descriptor=DescriptorComponent(name='Tree'),
+                                                              faction=MapItemDepot.factions['decorations']))
 
     @staticmethod
     def make_h_wall():
@@ -190,7 +206,7 @@ class MapItemDepot:
         return Construction(image_source='Wall_horizontal.png', passable=False,
                             fighter=FighterComponent(max_hp=10),
                             descriptor=DescriptorComponent(name='Wall segment'),
-                            faction=FactionComponent(faction='decorations'))
+                            faction=MapItemDepot.factions['decorations'])
 
     @staticmethod
     def make_v_wall():
@@ -201,7 +217,7 @@ class MapItemDepot:
         return Construction(image_source='Wall_vertical.png', passable=False,
                             fighter=FighterComponent(max_hp=10),
                             descriptor=DescriptorComponent(name='Wall segment'),
-                            faction=FactionComponent(faction='decorations'))
+                            faction=MapItemDepot.factions['decorations'])
 
     @staticmethod
     def make_nw_wall():
@@ -212,7 +228,7 @@ class MapItemDepot:
         return Construction(image_source='Wall_NW.png', passable=False,
                             fighter=FighterComponent(max_hp=10),
                             descriptor=DescriptorComponent(name='Wall segment'),
-                            faction=FactionComponent(faction='decorations'))
+                            faction=MapItemDepot.factions['decorations'])
 
     @staticmethod
     def make_ne_wall():
@@ -223,7 +239,7 @@ class MapItemDepot:
         return Construction(image_source='Wall_NE.png', passable=False,
                             fighter=FighterComponent(max_hp=10),
                             descriptor=DescriptorComponent(name='Wall segment'),
-                            faction=FactionComponent(faction='decorations'))\
+                            faction=MapItemDepot.factions['decorations'])\
 
     @staticmethod
     def make_spawner():
@@ -232,10 +248,9 @@ class MapItemDepot:
         :return:
         """
         return Spawner(image_source='ChassisFactory.png', spawn_frequency=3,
-                       spawn_factory=ActorFactory(faction=FactionComponent(faction='npc',
-                                                                           enemies=['pc']),
+                       spawn_factory=ActorFactory(faction=MapItemDepot.factions['npc'],
                                                   weights={'z': 1, 'g': 0}),
-                       faction=FactionComponent(faction='npc', enemies=['pc']),
+                       faction=MapItemDepot.factions['npc'],
                        descriptor=DescriptorComponent(name='Chassis factory'),
                        fighter=FighterComponent(max_hp=10, defenses=[0, 0]))
 
@@ -246,12 +261,12 @@ class MapItemDepot:
         :return:
         """
         return Upgrader(image_source='GunnerUpgrader.png',
-                        faction=FactionComponent(faction='npc', enemies=['pc']),
+                        faction=MapItemDepot.factions['npc'],
                         descriptor=DescriptorComponent(name='Gunner upgrader',
                                                        description='Fits chassis with a gun, producing Gunners'),
                         fighter=FighterComponent(max_hp=10, defenses=[0, 0]),
                         spawn_factory=ActorFactory(weights={'z': 0, 'g': 1, 't': 0},
-                                                   faction=FactionComponent(faction='npc', enemies=['pc'])),
+                                                   faction=MapItemDepot.factions['npc']),
                         passable=True, allow_entrance=True)
 
     @staticmethod
@@ -261,12 +276,12 @@ class MapItemDepot:
         :return:
         """
         return Upgrader(image_source='MeleeUpgrader.png',
-                        faction=FactionComponent(faction='npc', enemies=['pc']),
+                        faction=MapItemDepot.factions['npc'],
                         descriptor=DescriptorComponent(name='Thug upgrader',
                                                        description='Puts armor on chassis, producing Thugs'),
                         fighter=FighterComponent(max_hp=10, defenses=[0, 0]),
                         spawn_factory=ActorFactory(weights={'z': 0, 'g': 0, 't': 1},
-                                            faction=FactionComponent(faction='npc', enemies=['pc'])),
+                                            faction=MapItemDepot.factions['npc']),
                         passable=True, allow_entrance=True)
 
     @staticmethod
@@ -294,7 +309,7 @@ class MapItemDepot:
         """
         return FighterConstruction(image_source='MeleeTower.png', passable=False,
                                    fighter=FighterComponent(ammo=0, max_ammo=0),
-                                   faction=FactionComponent(faction='pc', enemies=['npc']),
+                                   faction=MapItemDepot.factions['pc'],
                                    descriptor=DescriptorComponent(name='Melee tower',
                                                                   description='This simple mechanism drops its heavy axe onto anything it considers an enemy.'),
                                    controller=FighterSpawnController())
@@ -307,7 +322,7 @@ class MapItemDepot:
         """
         return ShooterConstruction(image_source='Shooter.png', passable=False,
                                    fighter=FighterComponent(ammo=10, max_ammo=10),
-                                   faction=FactionComponent(faction='pc', enemies=['npc']),
+                                   faction=MapItemDepot.factions['pc'],
                                    descriptor=DescriptorComponent(name='Shooter',
                                                                   description='This construction shoots your enemies. Swinging at their weak points with a hefty barrel also works surprisingly well.'),
                                    controller=ShooterSpawnController())
@@ -317,112 +332,94 @@ class MapItemDepot:
         A regular thug
         :return:
         """
-        return Actor(image_source='Chassis.png',
-                     controller=MeleeAIController(dijkstra_weights={'PC': 1,
-                                                                    'upgraders': 1.5}),
-                     fighter=FighterComponent(max_hp=3, ammo=0, max_ammo=0),
-                     descriptor=DescriptorComponent(name='An empty chassis',
-                                                    description='The chassis on which weapons or tools could be installed.'),
-                     inventory=InventoryComponent(volume=1,
-                                                  initial_items=[self.make_random_item()]),
-                     faction=FactionComponent(faction='npc', enemies=['pc']))
+        return self.make_unit('chassis')
 
     def make_gunner(self):
         """
         An upgraded Chassis that gets three shots but only 1 HP
         :return:
         """
-        return Actor(image_source='GunnerChassis.png',
-                     controller=RangedAIController(),
-                     fighter=FighterComponent(max_hp=1, ammo=3, max_ammo=3),
-                     descriptor=DescriptorComponent(name='Gunner',
-                                                    description='A short-range gunner assembly.'),
-                     inventory=InventoryComponent(volume=1,
-                                                  initial_items=[self.make_random_item()]),
-                     faction=FactionComponent(faction='npc', enemies=['pc']))
+        return self.make_unit('gunner')
 
     def make_melee(self):
         """
         An upgraded Chassis with 7 HP
         :return:
         """
-        return Actor(image_source='Melee.png',
-                     controller=MeleeAIController(),
-                     fighter=FighterComponent(max_hp=7),
-                     descriptor=DescriptorComponent(name='Thug',
-                                                    description='A chassis protected by primitive armor'),
-                     inventory=InventoryComponent(volume=1,
-                                                  initial_items=[self.make_random_item()]),
-                     faction=FactionComponent(faction='npc', enemies=['pc']))
+        return self.make_unit('melee')
 
-    @staticmethod
-    def make_rocket():
+    def make_rocket(self):
         """
         Rocket
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Rocket',
-                                                             description='Can and should be [F]ired at enemies'),
-                              image_source='Rocket.png',
-                              effect=TileTargetedEffect(effect_type='explode', effect_value=5,
-                                                        require_targeting=True),
-                              event_type='rocket_shot')
+        return self.get_prototype('rocket', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Rocket',
+                                           description='Can and should be [F]ired at enemies'),
+            image_source='Rocket.png',
+            effect=TileTargetedEffect(effect_type='explode', effect_value=5,
+                                      require_targeting=True),
+            event_type='rocket_shot')).clone()
 
     def make_landmine(self):
         """
         Landmine (item)
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Landmine',
-                                                             description='Places a landmine under the player'),
-                              image_source='Landmine.png',
-                              effect=TileTargetedEffect(effect_type='spawn_construction',
-                                                        effect_value=self.make_mine()))
-    @staticmethod
-    def make_bottle():
+        return self.get_prototype('landmine', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Landmine',
+                                           description='Places a landmine under the player'),
+            image_source='Landmine.png',
+            effect=TileTargetedEffect(effect_type='spawn_construction',
+                                      effect_value=self.make_mine()))).clone()
+
+    def make_bottle(self):
         """
         Bottle
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Bottle',
-                                                             description='Heals for 2 or 3 HP'),
-                              image_source='Bottle.png',
-                              effect=FighterTargetedEffect(effect_type='heal',
-                                                           effect_value=[2, 3]))
+        return self.get_prototype('bottle', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Bottle',
+                                           description='Heals for 2 or 3 HP'),
+            image_source='Bottle.png',
+            effect=FighterTargetedEffect(effect_type='heal',
+                                         effect_value=[2, 3]))).clone()
 
-    @staticmethod
-    def make_ammo():
+    def make_ammo(self):
         """
         Restores 5 bullets
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Ammo',
-                                                             description='Reloads bullets'),
-                              effect=FighterTargetedEffect(effect_type='restore_ammo',
-                                                           effect_value=5),
-                              image_source='Ammo.png')
+        return self.get_prototype('ammo', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Ammo',
+                                           description='Reloads bullets'),
+            effect=FighterTargetedEffect(effect_type='restore_ammo',
+                                         effect_value=5),
+            image_source='Ammo.png')).clone()
 
     def make_flag(self):
         """
         Spawning flag
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Melee tower (unactive)',
-                                                             description='Installs a melee tower under the player'),
-                              image_source='MeleeBox.png',
-                              effect=TileTargetedEffect(effect_type='spawn_construction',
-                                                        effect_value=self.make_fighter()))
+        return self.get_prototype('flag', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Melee tower (unactive)',
+                                           description='Installs a melee tower under the player'),
+            image_source='MeleeBox.png',
+            effect=TileTargetedEffect(effect_type='spawn_construction',
+                                      effect_value=self.make_fighter()))).clone()
 
     def make_shooter_flag(self):
         """
         Shooter spawning flag
         :return:
         """
-        return PotionTypeItem(descriptor=DescriptorComponent(name='Shooter tower (inactive)',
-                                                             description='Installs a shooter tower under the player'),
-                              image_source='ShooterBox.png',
-                              effect=TileTargetedEffect(effect_type='spawn_construction',
-                                                        effect_value=self.make_shooter()))
+        return self.get_prototype('shooter_flag', lambda: PotionTypeItem(
+            descriptor=DescriptorComponent(name='Shooter tower (inactive)',
+                                           description='Installs a shooter tower under the player'),
+            image_source='ShooterBox.png',
+            effect=TileTargetedEffect(effect_type='spawn_construction',
+                                      effect_value=self.make_shooter()))).clone()
 
     #  Following methods generate items according to some rule
 
@@ -431,7 +428,7 @@ class MapItemDepot:
         Create a random item
         :return:
         """
-        method = choice(self.item_methods)
+        method = get_stream(self.random_stream).choice(self.item_methods)
         i = method()
         return i
 
@@ -454,12 +451,18 @@ class MapItemDepot:
         return self.glyph_methods[glyph]()
 
 
+#  The depot shared by all loaders and factories
+depot = MapItemDepot()
+
+
 class MapLoader:
     """
     The map file interface. It takes a filehandle and returns a complete map. Everything it needs to do so is not
     the caller's problem.
+    If max_resident_maps is set, only that many recently used maps are kept in memory, and the rest are
+    saved to snapshot_dir (see MapResidency)
     """
-    def __init__(self):
+    def __init__(self, max_resident_maps=None, snapshot_dir=None):
         #  A dict of tag-to-function mappings. Values should be callables that accept string and return
         #  an object of a required type
         self.tag_converters = {'height': int,
@@ -471,7 +474,7 @@ class MapLoader:
                                'neighbour_east': str,
                                'neighbour_north': str,
                                'on_entrance': str}
-        self.depot = MapItemDepot()
+        self.depot = depot
         self.layers = {'#': 'constructions',
                        '|': 'constructions',
                        '-': 'constructions',
@@ -495,7 +498,10 @@ class MapLoader:
                        '.': 'bg',
                        '~': 'bg'}
         #  All the maps loaded from file will be stored here
-        self.maps = {}
+        self.maps = MapResidency(capacity=max_resident_maps, directory=snapshot_dir)
+        #  Maps that were indexed, but not yet built: {map_id: (line reader, location, tags)}.
+        #  Reader is a callable that takes location and tags and returns glyph lines
+        self.map_index = {}
 
     def parse_tag_line(self, line):
         """
@@ -519,84 +525,304 @@ class MapLoader:
                 raise ValueError('Unknown tag {0} in the map file'.format(a[0]))
         return r
 
-    def read_map_file(self, file):
+    def read_map_file(self, file, lazy=True, use_cache=True, processes=1):
         """
         Read a file that contains maps.
-        :param handle: str
+        In lazy mode only the tags and the positions of map blocks are read, and every map is built on the first
+        get_map_by_id() call, so startup time doesn't depend on the number of maps in the file. Otherwise
+        all maps are built immediately, in `processes` worker processes if it's not 1.
+        If use_cache is True, maps are read from the compiled copy of the file (see LevelCache), which is
+        created if it doesn't exist or is outdated
+        :param file: str. Filename
+        :param lazy: bool
+        :param use_cache: bool
+        :param processes: int or None. Number of processes for building maps when not lazy. None means one
+        per CPU core
+        :return:
+        """
+        cached = None
+        if use_cache:
+            cached = read_cache(file)
+            if cached is None:
+                cached = write_cache(file, ((tags, lines) for tags, offset, lines in self.iter_map_blocks(file)))
+        if cached is not None:
+            reader = partial(read_compiled_lines, cache_filename(file))
+            index = [(tags, location, reader) for tags, location in cached]
+        else:
+            reader = partial(self._read_map_lines, file)
+            index = [(tags, offset, reader) for tags, offset, lines in self.iter_map_blocks(file, read_lines=False)]
+        if lazy:
+            for tags, location, reader in index:
+                self.map_index[tags['map_id']] = (reader, location, tags)
+        elif processes == 1:
+            for tags, location, reader in index:
+                self.maps[tags['map_id']] = self.build_map(tags, reader(location, tags))
+        else:
+            self._build_maps_in_pool(index, processes)
+
+    def _build_maps_in_pool(self, index, processes):
+        """
+        Build maps in a process pool.
+        Maps are returned to this process pickled. Dijkstra maps are recreated on unpickling, with their values
+        and attractors restored from the pickle (see RLMap.__getstate__). The per-map random streams are seeded
+        from the master seed in every worker, so the maps are the same as if they were built serially
+        :param index: list of (tags, location, reader) tuples
+        :param processes: int or None
+        :return:
+        """
+        #  Imported here, because it pulls in multiprocessing and logging, which add to startup time
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            #  Largest maps go first, so that a single big map doesn't end up being built last
+            blocks = sorted(index, key=lambda x: -x[0]['width'] * x[0]['height'])
+            for map in pool.map(partial(_build_map_in_worker, get_seed()), blocks):
+                self.maps[map.map_id] = map
+
+    def iter_map_blocks(self, file, read_lines=True):
+        """
+        Parse a text map file, yielding maps one at a time.
+        A map block is a few tag lines followed by glyph lines. Blocks are separated by empty lines; the last
+        one doesn't have to be followed by it. Tag lines start with '/' and are recognized only before
+        the first glyph line of a block, so glyph lines can start with '/' too.
+        Only the current block is kept in memory, and every block is checked before it's yielded, so that
+        a broken map is reported when the file is read rather than when the map is first visited.
+        Errors are raised as ValueError with file name and line number
+        :param file: str. Filename
+        :param read_lines: bool. If False, glyph lines are checked, but not returned
+        :return: generator of (tags, byte offset of the first glyph line, list of glyph lines or None) tuples
+        """
+        map_ids = set()
+        tags = {}
+        lines = []
+        line_count = 0
+        #  Byte offset of the current line and of the first glyph line of the current block
+        offset = 0
+        block_offset = None
+        block_start = 1
+        #  The file is read in binary mode, because text mode doesn't allow tell() while iterating
+        with open(file, mode='rb') as map_file:
+            for number, raw_line in enumerate(map_file, start=1):
+                try:
+                    line = raw_line.decode('utf-8').rstrip('\r\n')
+                    if not line:
+                        #  Empty line means that one map ended and the next will maybe begin from the next line
+                        if tags or line_count:
+                            self._check_block(tags, line_count, map_ids)
+                            yield tags, block_offset, lines if read_lines else None
+                        tags = {}
+                        lines = []
+                        line_count = 0
+                        block_offset = None
+                        block_start = number + 1
+                    elif line[0] == '/' and block_offset is None:
+                        l = self.parse_tag_line(line)
+                        tags.update({l[0]: l[1]})
+                    else:
+                        if block_offset is None:
+                            block_offset = offset
+                            if 'width' not in tags:
+                                raise ValueError('Map has no width tag')
+                        self._check_line(line, tags['width'])
+                        line_count += 1
+                        if read_lines:
+                            lines.append(line)
+                except ValueError as e:
+                    raise ValueError('{0}:{1}: {2}'.format(file, number, e))
+                offset += len(raw_line)
+        if tags or line_count:
+            try:
+                self._check_block(tags, line_count, map_ids)
+            except ValueError as e:
+                raise ValueError('{0}:{1}: {2}'.format(file, block_start, e))
+            yield tags, block_offset, lines if read_lines else None
+
+    def _check_line(self, line, width):
+        """
+        Raise ValueError if a glyph line has a wrong length or contains unknown glyphs
+        :param line: str, without a newline
+        :param width: int
         :return:
         """
-        tags = {}
-        map_lines = []
-        for line in open(file):
-            if line[0] == '/':
-                l = self.parse_tag_line(line)
-                tags.update({l[0]: l[1]})
-            elif line == '\n':
-                #  Empty line means that one map ended and the next will maybe begin from the next line
-                #  Anyway, time to compile the map
-                map = RLMap(size=(tags['width'], tags['height']), layers=['bg', 'constructions', 'items', 'actors'])
-                for y in range(0, tags['height']):
-                    for x in range(0, tags['width']):
-                        map.add_item(self.depot.make_passable_tile(),
-                                     layer='bg', location=(x, tags['height']-1-y))
-                        i = map_lines[y][x]
-                        if i == '.':
-                            #  Nothing to place here
-                            continue
-                        item = self.depot.get_item_by_glyph(i)
-                        map.add_item(item=item,
-                                     layer=self.layers[i],
-                                     location=(x, tags['height']-1-y))
-                #  Neighbouring map IDs
-                for tag in [x for x in tags.keys() if 'neighbour_' in x]:
-                    direction = tag.split('_')[1]
-                    map.neighbour_maps[direction] = tags[tag]
-                if 'on_entrance' in tags.keys():
-                    map.entrance_message = tags['on_entrance']
-                map.rebuild_dijkstras()
-                self.maps[tags['map_id']] = map
-                print('Loaded map: {0}'.format(tags['map_id']))
-                tags = {}
-                map_lines = []
-            else:
-                map_lines.append(line)
+        if len(line) != width:
+            raise ValueError('Map line has {0} glyphs instead of {1}'.format(len(line), width))
+        unknown = set(line).difference(self.layers)
+        if unknown:
+            raise ValueError('Unknown glyphs {0} in the map file'.format(''.join(sorted(unknown))))
+
+    @staticmethod
+    def _check_block(tags, line_count, map_ids):
+        """
+        Raise ValueError if a map block lacks required tags, has a wrong number of lines or a duplicate ID.
+        :param tags: dict of tag values
+        :param line_count: int. Number of glyph lines in the block
+        :param map_ids: set of IDs of the previous blocks. Updated by this method
+        :return:
+        """
+        for tag in ('map_id', 'width', 'height'):
+            if tag not in tags:
+                raise ValueError('Map has no {0} tag'.format(tag))
+        if line_count != tags['height']:
+            raise ValueError('Map {0} has {1} lines instead of {2}'.format(tags['map_id'], line_count,
+                                                                          tags['height']))
+        if tags['map_id'] in map_ids:
+            raise ValueError('Duplicate map ID {0}'.format(tags['map_id']))
+        map_ids.add(tags['map_id'])
+
+    @staticmethod
+    def _read_map_lines(file, offset, tags):
+        """
+        Read glyph lines of a single map from the text file
+        :param file: str. Filename
+        :param offset: int. Byte offset of the first line
+        :param tags: dict of map tags
+        :return: list of str
+        """
+        with open(file, mode='rb') as map_file:
+            map_file.seek(offset)
+            return [map_file.readline().decode('utf-8') for y in range(tags['height'])]
+
+    def build_map(self, tags, map_lines):
+        """
+        Create an RLMap from its tags and glyph lines.
+        Random items are drawn from a stream of their own for every map, so that the contents of a map don't
+        depend on the order in which maps are built
+        :param tags: dict of tag values
+        :param map_lines: list of str
+        :return: RLMap
+        """
+        #  The depot is shared with the factories that spawn units during the game, so the stream is reset
+        #  even if the map is broken
+        self.depot.random_stream = 'map:' + tags['map_id']
+        try:
+            map = RLMap(size=(tags['width'], tags['height']), layers=['bg', 'constructions', 'items', 'actors'])
+            for y in range(0, tags['height']):
+                for x in range(0, tags['width']):
+                    map.add_item(self.depot.make_passable_tile(),
+                                 layer='bg', location=(x, tags['height']-1-y))
+                    i = map_lines[y][x]
+                    if i == '.':
+                        #  Nothing to place here
+                        continue
+                    item = self.depot.get_item_by_glyph(i)
+                    map.add_item(item=item,
+                                 layer=self.layers[i],
+                                 location=(x, tags['height']-1-y))
+            #  Neighbouring map IDs
+            for tag in [x for x in tags.keys() if 'neighbour_' in x]:
+                direction = tag.split('_')[1]
+                map.neighbour_maps[direction] = tags[tag]
+            if 'on_entrance' in tags.keys():
+                map.entrance_message = tags['on_entrance']
+            map.map_id = tags['map_id']
+            map.rebuild_dijkstras()
+        finally:
+            self.depot.random_stream = 'spawn'
+        print('Loaded map: {0}'.format(tags['map_id']))
+        return map
 
     def get_map_by_id(self, map_id):
         """
         Return a map with a given ID.
         This method assumes that map-loading was done before it was called and that there is, in fact,
-        such a map in the file
+        such a map in the file. Maps that were only indexed are built on the first call, and evicted maps are
+        restored from their snapshots
         :param map_id:
         :return:
         """
-        return self.maps[map_id]
+        try:
+            return self.maps[map_id]
+        except KeyError:
+            reader, location, tags = self.map_index[map_id]
+            self.maps[map_id] = self.build_map(tags, reader(location, tags))
+            return self.maps[map_id]
+
+
+#  MapLoader of a worker process in MapLoader._build_maps_in_pool(). Created with the first map built there
+_worker_loader = None
+
+
+def _build_map_in_worker(seed, block):
+    """
+    Build a single map in a worker process
+    :param seed: master seed of RandomStreams in the main process
+    :param block: (tags, location, reader) tuple from the map index
+    :return: RLMap
+    """
+    global _worker_loader
+    if _worker_loader is None:
+        seed_streams(seed)
+        _worker_loader = MapLoader()
+    tags, location, reader = block
+    return _worker_loader.build_map(tags, reader(location, tags))
 
 
 class ActorFactory(object):
     """
-    Factory that produces Actors of a given faction
+    Factory that produces Actors of a given faction.
+    Unit weights are compiled into a list of unit types and a list of cumulative weights, so that picking a unit
+    type is a single bisect rather than a walk over the weights dict. The lists are rebuilt whenever self.weights
+    is assigned; a weights dict changed in place should be assigned again
     """
     def __init__(self, faction, weights={'z': 0, 'g': 1, 't': 1}):
         assert isinstance(faction, FactionComponent)
         self.faction = faction
-        self.depot = MapItemDepot()
+        self.depot = depot
         self.unit_methods = {'z': self.depot.make_chassis,
                              'g': self.depot.make_gunner,
                              't': self.depot.make_melee}
         self.weights = weights
 
+    @property
+    def weights(self):
+        return self._weights
+
+    @weights.setter
+    def weights(self, value):
+        self._weights = value
+        self._unit_types = list(value.keys())
+        self._cumulative_weights = []
+        s = 0
+        for x in self._unit_types:
+            s += value[x]
+            self._cumulative_weights.append(s)
+
+    def __getstate__(self):
+        #  The depot is shared, so it is not pickled with every factory. Compiled weights are rebuilt on unpickling
+        state = self.__dict__.copy()
+        for name in ('depot', 'unit_methods', '_weights', '_unit_types', '_cumulative_weights'):
+            del state[name]
+        state['weights'] = self._weights
+        return state
+
+    def __setstate__(self, state):
+        weights = state.pop('weights')
+        self.__dict__.update(state)
+        self.weights = weights
+        self.depot = depot
+        self.unit_methods = {'z': self.depot.make_chassis,
+                             'g': self.depot.make_gunner,
+                             't': self.depot.make_melee}
+
     def create_unit(self):
         """
         Creates a random unit that this class knows about.
         Units that are assigned zero in self.weights will never be produced.
         :return:
         """
-        r = randint(1, sum(self.weights.values()))
-        s = 0
-        child = None
-        for x in self.weights.keys():
-            s += self.weights[x]
-            if s >= r:
-                child = x
-                break
-        return self.unit_methods[child]()
+        return self.create_units(1)[0]
+
+    def create_units(self, count):
+        """
+        Create several random units at once.
+        Every unit is created right after its type is drawn, because units draw their items from the same random
+        stream. So a wave gets the same units as `count` calls to self.create_unit() would produce
+        :param count: int
+        :return: list of Actor
+        """
+        randint = get_stream('spawn').randint
+        unit_types = self._unit_types
+        cumulative_weights = self._cumulative_weights
+        total = cumulative_weights[-1]
+        unit_methods = self.unit_methods
+        return [unit_methods[unit_types[bisect_left(cumulative_weights, randint(1, total))]]()
+                for _ in range(count)]
@@ -1,7 +1,11 @@
 """
-GameEvent base class and the event queue
+GameEvent base class and the event queues
 """
+import threading
 from collections import deque
+from queue import SimpleQueue, Empty
+
+from Tracing import tracer
 
 
 class GameEvent:
@@ -42,6 +46,9 @@ class GameEvent:
 class EventDispatcher:
     """
     Event queue. Currently a wrapper around a standard collections.deque
+    Listener list is copy-on-write: registering or unregistering replaces self.listeners with a new list, so
+    listeners can be added and removed while an event is being dispatched. The event being dispatched is
+    still passed to the listeners that were registered when its dispatch started.
     """
     def __init__(self):
         self._deque = deque()
@@ -86,7 +93,7 @@ class EventDispatcher:
         pass_event() with the event.
         """
         if hasattr(listener, 'process_game_event'):
-            self.listeners.append(listener)
+            self.listeners = self.listeners + [listener]
         else:
             raise AttributeError('Listener doesn\'t have process_game_event() method')
 
@@ -98,7 +105,9 @@ class EventDispatcher:
         :param listener:
         :return:
         """
-        self.listeners.remove(listener)
+        listeners = list(self.listeners)
+        listeners.remove(listener)
+        self.listeners = listeners
 
     def pass_event(self):
         """
@@ -106,9 +115,26 @@ class EventDispatcher:
         :return:
         """
         e = self.popleft()
+        if tracer.enabled:
+            self._pass_traced_event(e)
+            return
+        #  self.listeners may be replaced while the loop runs; the loop keeps iterating over the old list
         for listener in self.listeners:
             listener.process_game_event(e)
 
+    def _pass_traced_event(self, event):
+        """
+        Pass an event to all listeners, recording the dispatch and every listener call as trace spans
+        :param event: GameEvent
+        :return:
+        """
+        start = tracer.clock()
+        for listener in self.listeners:
+            listener_start = tracer.clock()
+            listener.process_game_event(event)
+            tracer.complete(type(listener).__name__, category='listener', start=listener_start)
+        tracer.complete(event.event_type, category='dispatch', start=start)
+
     def pass_all_events(self):
         """
         Pass all the events in the queue to listeners. In addition, passes a special `queue_exhausted` event
@@ -121,3 +147,102 @@ class EventDispatcher:
         #  something unforeseen to the queue
         self.append(GameEvent(event_type='queue_exhausted'))
         self.pass_event()
+
+
+class ThreadSafeEventDispatcher(EventDispatcher):
+    """
+    Event queue that accepts events from any thread, but delivers them only on the thread that created it
+    (the owner thread, ie the kivy main thread).
+    Events appended on the owner thread are processed exactly as in EventDispatcher. Events appended from other
+    threads (or sent via self.post()) go to a thread-safe inbox. Then the schedule_delivery hook is called with
+    self.deliver_posted as its only argument; it should arrange for that callable to be run on the owner thread,
+    eg `lambda callback: Clock.schedule_once(lambda dt: callback())`. If there is no hook, posted events wait
+    until the next pass_all_events() or deliver_posted() on the owner thread.
+    Posted events are delivered without a trailing 'queue_exhausted' event, because they don't belong to a turn.
+    """
+    def __init__(self, schedule_delivery=None):
+        super(ThreadSafeEventDispatcher, self).__init__()
+        self.schedule_delivery = schedule_delivery
+        self._owner = threading.get_ident()
+        self._inbox = SimpleQueue()
+        #  Protects self.listeners replacement and self._delivery_scheduled
+        self._lock = threading.Lock()
+        self._delivery_scheduled = False
+
+    def is_owner_thread(self):
+        return threading.get_ident() == self._owner
+
+    def append(self, item):
+        """
+        Push a GameEvent to the queue. Events from non-owner threads are posted to the inbox instead
+        :param item: GameEvent to add
+        :return:
+        """
+        if self.is_owner_thread():
+            super(ThreadSafeEventDispatcher, self).append(item)
+        else:
+            self.post(item)
+
+    def post(self, item):
+        """
+        Push a GameEvent to the inbox. Safe to call from any thread
+        :param item: GameEvent to add
+        :return:
+        """
+        if not isinstance(item, GameEvent):
+            raise ValueError('Only GameEvents can be pushed to the event queue')
+        self._inbox.put(item)
+        with self._lock:
+            if self._delivery_scheduled or not self.schedule_delivery:
+                return
+            self._delivery_scheduled = True
+        self.schedule_delivery(self.deliver_posted)
+
+    def clear(self):
+        """
+        Remove all queued and posted events, so that events posted before the call are never delivered
+        :return:
+        """
+        with self._lock:
+            super(ThreadSafeEventDispatcher, self).clear()
+            while True:
+                try:
+                    self._inbox.get_nowait()
+                except Empty:
+                    break
+            self._delivery_scheduled = False
+
+    def deliver_posted(self):
+        """
+        Pass all the posted events to listeners. Should only be called on the owner thread
+        :return:
+        """
+        if not self.is_owner_thread():
+            raise RuntimeError('Posted events can only be delivered on the thread that owns the queue')
+        with self._lock:
+            self._delivery_scheduled = False
+        while True:
+            try:
+                self._deque.append(self._inbox.get_nowait())
+            except Empty:
+                break
+        while len(self._deque) > 0:
+            self.pass_event()
+
+    def pass_all_events(self):
+        """
+        Pass all posted and queued events to listeners, followed by a 'queue_exhausted' event
+        :return:
+        """
+        if not self.is_owner_thread():
+            raise RuntimeError('Events can only be passed on the thread that owns the queue')
+        self.deliver_posted()
+        super(ThreadSafeEventDispatcher, self).pass_all_events()
+
+    def register_listener(self, listener):
+        with self._lock:
+            super(ThreadSafeEventDispatcher, self).register_listener(listener)
+
+    def unregister_listener(self, listener):
+        with self._lock:
+            super(ThreadSafeEventDispatcher, self).unregister_listener(listener)
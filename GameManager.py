@@ -0,0 +1,145 @@
+"""
+GameManager, the object that ties together maps, the event queue and the interface.
+This module doesn't depend on kivy, so the game can be run without any interface (eg for replays)
+"""
+
+from Factories import MapLoader
+from Controller import PlayerController
+from GameEvent import EventDispatcher, GameEvent, ThreadSafeEventDispatcher
+from Profiling import TurnProfiler
+from RandomStreams import seed_streams
+
+
+class GameManager():
+    """
+    A singleton game manager. It holds data about current map, GameEvent queue and so on.
+    Basically anything that is neither interface nor is limited to a single map/actor belongs here
+    """
+    def __init__(self, map_file='test_level.lvl', seed=None, thread_safe_queue=False, max_resident_maps=None):
+        #  Random streams should be seeded before anything is loaded, because map loading already
+        #  uses random (eg for items in enemy inventories)
+        if seed is not None:
+            seed_streams(seed)
+        self.seed = seed
+        self.map_file = map_file
+        #  Thread-safe queue allows background threads to post events. It has to be created on the main thread
+        if thread_safe_queue:
+            self.queue = ThreadSafeEventDispatcher()
+        else:
+            self.queue = EventDispatcher()
+        #  If max_resident_maps is set, least recently used maps are evicted to disk (see MapResidency)
+        self.map_loader = MapLoader(max_resident_maps=max_resident_maps)
+        self.map_loader.read_map_file(map_file)
+        self.map = None
+        self.game_widget = None
+        #  If set, every command passed to self.process_turn() is reported to this SessionRecorder
+        self.recorder = None
+        #  Turn phase timer. Disabled by default, can be toggled at any moment
+        self.profiler = TurnProfiler()
+        #  If set, turns are made through this SlowTurnWatchdog
+        self.watchdog = None
+        #  Log list. Initial values allow not to have empty log at the startup
+        self.game_log = []
+
+    def _load_map(self, map_id='start'):
+        """
+        Load a new map with a given ID.
+        Doesn't do anything to widgets: just loads the map and connects the queue. The first map loaded is
+        drawn by GameWidget's __init__(), for others you should call self.switch_map(), not this method
+        :param map_id: str
+        :return: Map
+        """
+        self.map = self.map_loader.get_map_by_id(map_id)
+        self.map.register_manager(self)
+        return self.map
+
+    def switch_map(self, map_id='empty', entrance_direction=None):
+        """
+        Switch to a new map.
+        Assumes the map is available from self.map_loader. The queue is cleaned up because otherwise
+        some animations on non-displayed items are run after switch. PC, if any, is retained
+        :param map_id:
+        :return:
+        """
+        self.queue.clear()
+        pc = None
+        if self.map:
+            pc = self.map.actors[0]
+            self.map.delete_item(layer='actors', location=pc.location)
+            self.map.unregister_manager()
+        self._load_map(map_id)
+        if len(self.map.entrance_message) > 0:
+            self.map.extend_log(self.map.entrance_message)
+        if pc:  # pc is None only for the first map loaded just after starting the app
+            if entrance_direction == 'north':
+                pc.location = [pc.location[0], self.map.size[1]-1]
+            elif entrance_direction == 'south':
+                pc.location = [pc.location[0], 0]
+            elif entrance_direction == 'west':
+                pc.location = [self.map.size[0]-1, pc.location[1]]
+            elif entrance_direction == 'east':
+                pc.location = [0, pc.location[1]]
+            else:
+                raise ValueError('Only one of north, south, west or east is accepted as entrance_direction')
+            #  There may be zero actors on the map, if there are no enemies and (wrong) PC was removed upon load
+            if len(self.map.actors) >= 1 and isinstance(self.map.actors[0].controller, PlayerController):
+                self.map.delete_item(layer='actors', location=self.map.actors[0].location)
+            self.map.add_item(item=pc, layer='actors', location=pc.location)
+            #  There is no widget when the game runs headless
+            if self.game_widget:
+                self.game_widget.rebuild_map_widget()
+        else:
+            #  These events are necessary to initialize UI
+            self.queue.append(GameEvent(event_type='hp_changed',
+                                        actor=self.map.actors[0]))
+            self.queue.append(GameEvent(event_type='inventory_updated',
+                                        actor=self.map.actors[0]))
+
+    def process_turn(self, command=None):
+        """
+        Make a turn on the current map with a given PC command.
+        Interface should call this instead of self.map.process_turn(), so that the command is recorded if
+        a recorder is attached
+        :param command: Command
+        :return:
+        """
+        if self.watchdog:
+            self.watchdog.process_turn(self.map, command)
+        else:
+            self.map.process_turn(command=command)
+        if self.recorder:
+            self.recorder.record_turn(command)
+
+    def process_events(self):
+        """
+        Process all events in a queue
+        :return:
+        """
+        self.queue.pass_all_events()
+
+    def register_listener(self, listener):
+        """
+        Add a queue listener to both queue and self.
+        Listeners registered here get their game_manager attribute set to self. It can allow them to interact
+        with the game, ordering GameManager to change levels, finish the game and so on. This widget also gets
+        access to the entire game information via self.map and self.queue.
+        Thus, it's advised to use this method only for listeners that need to do so; achievement trackers,
+        whatever else *views* the game should be registered to queue directly.
+        :param listener:
+        :return:
+        """
+        self.queue.register_listener(listener)
+        listener.game_manager = self
+
+    def register_widget(self, widget):
+        """
+        Introduce yourself to a widget that will need to refer to this object's data.
+        This is meant for widgets that need access to game data, but do not need to read queue. For example,
+        inventory widget needs to know what's in PC's pockets, but doesn't need access to the event queue. It is
+        told to update by RLMapWidget when its time comes. Unless absolutely necessary, it's better to avoid
+        subscribing widgets to queue and thus having their process_game_event called for everything that happened
+        in the game world.
+        :param widget:
+        :return:
+        """
+        widget.game_manager = self
@@ -2,11 +2,10 @@
 Item and Effect classes and their subclasses.
 """
 
-from random import random, choice
-
 from Actor import GameEvent
 from Constructions import Construction
 from MapItem import MapItem
+from RandomStreams import get_stream
 
 
 class Effect(object):
@@ -24,6 +23,17 @@ class Effect(object):
         self.effect_value = effect_value
         self.require_targeting = require_targeting
 
+    def clone(self):
+        """
+        Return a copy of this effect. A construction to be spawned is copied as well
+        :return:
+        """
+        r = object.__new__(type(self))
+        r.__dict__.update(self.__dict__)
+        if isinstance(self.effect_value, MapItem):
+            r.effect_value = self.effect_value.clone()
+        return r
+
 
 class FighterTargetedEffect(Effect):
     """
@@ -34,7 +44,7 @@ class FighterTargetedEffect(Effect):
 
     def affect(self, actor):
         if self.effect_type == 'heal':
-            actor.fighter.hp += choice(self.effect_value)
+            actor.fighter.hp += get_stream('effects').choice(self.effect_value)
             return True
         if self.effect_type == 'restore_ammo':
             actor.fighter.ammo += self.effect_value
@@ -75,7 +85,7 @@ class TileTargetedEffect(Effect):
                         victim.fighter.get_damaged(self.effect_value)
                 for victim in map.get_column(tile):
                     #  Items are checked in a separate cycle because items could've been dropped by killed enemies
-                    if isinstance(victim, Item) and (random() > 0.5 or tile == location):
+                    if isinstance(victim, Item) and (get_stream('effects').random() > 0.5 or tile == location):
                         map.delete_item(layer='items', location=tile)
                         map.game_events.append(GameEvent(event_type='was_destroyed',
                                                          actor=victim, location=tile))
@@ -94,6 +104,8 @@ class Item(MapItem):
     """
     Base class for the inventory item. Inherits from MapItem to allow placing items on map.
     """
+    __slots__ = ('owner', 'descriptor', 'event_type')
+
     def __init__(self, name='Item', image_source='Bottle.png', owner=None, descriptor=None,
                  event_type=None, **kwargs):
         super(Item, self).__init__(**kwargs)
@@ -106,6 +118,18 @@ class Item(MapItem):
         #  event_type currently is used only by TileTargeted items used with Target
         self.event_type = event_type
 
+    def clone(self):
+        """
+        Return a copy of this item that is not in any inventory
+        :return:
+        """
+        r = super(Item, self).clone()
+        r.owner = None
+        if self.descriptor:
+            r.descriptor = self.descriptor.clone()
+            r.descriptor.actor = r
+        return r
+
     @property
     def name(self):
         return self.descriptor.name
@@ -129,10 +153,22 @@ class PotionTypeItem(Item):
     When creating object, it should be supplied with the Effect class instance that
     can affect Actor class.
     """
+    __slots__ = ('effect',)
+
     def __init__(self, effect=lambda a: None, **kwargs):
         super(PotionTypeItem, self).__init__(**kwargs)
         self.effect = effect
 
+    def clone(self):
+        """
+        Return a copy of this item with a copy of its effect
+        :return:
+        """
+        r = super(PotionTypeItem, self).clone()
+        if isinstance(self.effect, Effect):
+            r.effect = self.effect.clone()
+        return r
+
     def use(self, target=None):
         """
         Spend this item: apply effect, remove it from inventory and send a message to game log
@@ -0,0 +1,215 @@
+"""
+Compiled level cache.
+Parsing a text level file means reading and decoding it line by line every launch. The first time a level file is
+read, MapLoader saves its maps in a compact binary form next to it (test_level.lvl -> test_level.lvlc) and
+uses that file on later launches. The cache remembers the mtime and SHA1 of the source; it is rebuilt when the
+source is changed. A changed mtime alone (eg the file was touched or checked out again) doesn't invalidate the
+cache: the hash decides, and if it matches, the new mtime is saved, so that the source isn't hashed again.
+
+Layout: an 8-byte signature, the 8-byte little-endian offset of the index, map bodies and the JSON index. The index
+holds the source mtime and hash and, for every map, its tags and the offset and length of its body. A body is
+the glyph grid, top to bottom, run-length encoded as (count, glyph) byte pairs. The index goes last, so that
+maps can be written as they are parsed, without keeping the whole level in memory.
+
+Usage: python3 LevelCache.py [level_file] [repeats]
+Compiles the level file and compares loading times: text and compiled, serial and parallel.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+from functools import partial
+from time import perf_counter
+
+SIGNATURE = b'CAMPLVL\x02'
+
+
+def cache_filename(source):
+    """
+    Return the name of the compiled file for a given level file
+    :param source: str
+    :return: str
+    """
+    return source + 'c'
+
+
+def file_hash(filename):
+    """
+    Return SHA1 of a file contents
+    :param filename: str
+    :return: str
+    """
+    h = hashlib.sha1()
+    with open(filename, mode='rb') as f:
+        for chunk in iter(partial(f.read, 65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_grid(lines, width):
+    """
+    Run-length encode a glyph grid
+    :param lines: list of str. Trailing newlines are ignored
+    :param width: int
+    :return: bytes
+    """
+    grid = ''.join(line[:width] for line in lines).encode('ascii')
+    r = bytearray()
+    i = 0
+    while i < len(grid):
+        glyph = grid[i]
+        count = 1
+        while i + count < len(grid) and grid[i + count] == glyph and count < 255:
+            count += 1
+        r.append(count)
+        r.append(glyph)
+        i += count
+    return bytes(r)
+
+
+def decode_grid(data, width):
+    """
+    Restore glyph lines from run-length encoded grid
+    :param data: bytes
+    :param width: int
+    :return: list of str
+    """
+    grid = b''.join(bytes((data[i + 1],)) * data[i] for i in range(0, len(data), 2)).decode('ascii')
+    return [grid[x:x + width] for x in range(0, len(grid), width)]
+
+
+def write_cache(source, maps):
+    """
+    Compile maps read from a level file.
+    The cache is written to a temporary file and renamed, so that a half-written cache is never read.
+    Failing to write (eg the level is in a read-only directory) is not an error: the cache just isn't used.
+    Errors raised while iterating over maps are passed on
+    :param source: str. Level filename
+    :param maps: iterable of (tags, lines) tuples
+    :return: list of (tags, (offset, length)) tuples, same as read_cache(), or None if the cache wasn't written
+    """
+    filename = cache_filename(source)
+    entries = []
+    try:
+        with open(filename + '.tmp', mode='wb') as f:
+            f.write(SIGNATURE)
+            f.write(struct.pack('<Q', 0))
+            for tags, lines in maps:
+                body = encode_grid(lines, tags['width'])
+                entries.append({'tags': tags, 'offset': f.tell(), 'length': len(body)})
+                f.write(body)
+            header_offset = f.tell()
+            f.write(json.dumps({'mtime': os.stat(source).st_mtime_ns,
+                                'hash': file_hash(source),
+                                'maps': entries}).encode('utf-8'))
+            f.seek(len(SIGNATURE))
+            f.write(struct.pack('<Q', header_offset))
+        os.replace(filename + '.tmp', filename)
+    except OSError:
+        _remove(filename + '.tmp')
+        return None
+    except Exception:
+        _remove(filename + '.tmp')
+        raise
+    return [(entry['tags'], (entry['offset'], entry['length'])) for entry in entries]
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def read_cache(source):
+    """
+    Read the index of a compiled level.
+    Returns None if there is no cache for this level or it is outdated. The cache is outdated if the source
+    mtime differs from the stored one and so does its hash; if only the mtime differs, the stored one is updated
+    :param source: str. Level filename
+    :return: list of (tags, (offset, length)) tuples. Offsets are absolute, to be passed to read_compiled_lines()
+    """
+    try:
+        with open(cache_filename(source), mode='rb') as f:
+            if f.read(len(SIGNATURE)) != SIGNATURE:
+                return None
+            header_offset = struct.unpack('<Q', f.read(8))[0]
+            f.seek(header_offset)
+            header = json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError, struct.error):
+        return None
+    mtime = os.stat(source).st_mtime_ns
+    if header['mtime'] != mtime:
+        if header['hash'] != file_hash(source):
+            return None
+        header['mtime'] = mtime
+        _rewrite_header(cache_filename(source), header_offset, header)
+    return [(entry['tags'], (entry['offset'], entry['length'])) for entry in header['maps']]
+
+
+def _rewrite_header(filename, header_offset, header):
+    """
+    Replace the index of a compiled file.
+    Failing to write is not an error: the source will just be hashed again next time
+    :param filename: str. Compiled filename
+    :param header_offset: int
+    :param header: dict
+    :return:
+    """
+    try:
+        with open(filename, mode='r+b') as f:
+            f.seek(header_offset)
+            f.write(json.dumps(header).encode('utf-8'))
+            f.truncate()
+    except OSError:
+        pass
+
+
+def read_compiled_lines(filename, location, tags):
+    """
+    Read glyph lines of a single map from the compiled file
+    :param filename: str. Compiled filename
+    :param location: (offset, length) tuple returned by read_cache()
+    :param tags: dict of map tags
+    :return: list of str
+    """
+    with open(filename, mode='rb') as f:
+        f.seek(location[0])
+        return decode_grid(f.read(location[1]), tags['width'])
+
+
+def benchmark(source, repeats=5):
+    """
+    Compare loading a level file from text and from the compiled cache, and building maps serially and in
+    a process pool.
+    Indexing is what happens at startup in lazy mode; eager loading builds every map
+    :param source: str. Level filename
+    :param repeats: int. Best of how many runs is reported
+    :return: str
+    """
+    from Factories import MapLoader
+    MapLoader().read_map_file(source, use_cache=True)
+    lines = ['{0}: {1} bytes text, {2} bytes compiled, {3} CPUs'.format(source, os.path.getsize(source),
+                                                                       os.path.getsize(cache_filename(source)),
+                                                                       os.cpu_count())]
+    for name, lazy, use_cache, processes in (('lazy text', True, False, 1),
+                                             ('lazy compiled', True, True, 1),
+                                             ('eager text', False, False, 1),
+                                             ('eager compiled', False, True, 1),
+                                             ('eager compiled parallel', False, True, None)):
+        best = None
+        for _ in range(repeats):
+            start = perf_counter()
+            loader = MapLoader()
+            loader.read_map_file(source, lazy=lazy, use_cache=use_cache, processes=processes)
+            duration = perf_counter() - start
+            best = duration if best is None else min(best, duration)
+        lines.append('{0:>24} {1:10.2f} ms'.format(name, best * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark(sys.argv[1] if len(sys.argv) > 1 else 'test_level.lvl',
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 5))
@@ -185,6 +185,23 @@ class RLMap(object):
         self.game_events = None
         self.game_manager = None
         #  The Dijkstra maps
+        self.dijkstras = {}
+        self._create_dijkstras()
+        #  Neighbouring maps
+        self.neighbour_maps = {}
+        self.entrance_message = ''
+        #  ID under which this map is known to MapLoader. Set by the loader
+        self.map_id = None
+        #  Cells changed since the last self.consume_dirty_cells() call, as {layer: set of (x, y)}.
+        #  None until something asks for them with self.track_dirty_cells(), so that maps nobody draws
+        #  (or maps that are being built) don't spend anything on it
+        self.dirty_cells = None
+
+    def _create_dijkstras(self):
+        """
+        Create (empty) Dijkstra maps. They should be filled with self.rebuild_dijkstras() after the map is built
+        :return:
+        """
         #  Somehow it feels like it doesn't belong here, but I'm not sure where it should be
         self.dijkstras = {
                         #  A map that has PC as the sole attractor. Used by all AI for combat
@@ -207,9 +224,29 @@ class RLMap(object):
                                                     lambda x: isinstance(x, Upgrader)
                                                 ]
                                                 )}
-        #  Neighbouring maps
-        self.neighbour_maps = {}
-        self.entrance_message = ''
+
+    def __getstate__(self):
+        """
+        Pickle the map without its connections to the game manager.
+        Dijkstra maps are not pickled as is, because their filters are lambdas; only their values and attractors
+        are, and the maps are recreated from them on unpickling. Attractors that are no longer on this map
+        (eg PC who has left it) are not pickled, or the unpickled map would get their copies
+        :return:
+        """
+        state = self.__dict__.copy()
+        state['game_events'] = None
+        state['game_manager'] = None
+        state['dijkstras'] = {name: (dijkstra._values, [x for x in dijkstra.attractors if self.is_placed(x)])
+                              for name, dijkstra in self.dijkstras.items()}
+        return state
+
+    def __setstate__(self, state):
+        dijkstras = state.pop('dijkstras')
+        self.__dict__.update(state)
+        self._create_dijkstras()
+        for name, (values, attractors) in dijkstras.items():
+            self.dijkstras[name]._values = values
+            self.dijkstras[name].attractors = attractors
 
     def register_manager(self, game_manager):
         """
@@ -221,6 +258,29 @@ class RLMap(object):
         for dijkstra in self.dijkstras.values():
             self.game_events.register_listener(dijkstra)
 
+    def unregister_manager(self):
+        """
+        Stop listening to the queue. Called when PC leaves the map: Dijkstra maps shouldn't be updated with
+        the events of other maps, and the queue shouldn't keep the map from being garbage collected or evicted
+        (see MapResidency).
+        Attractors that have left the map are forgotten. If PC comes back, rebuilding Dijkstra maps finds
+        them anew
+        :return:
+        """
+        if self.game_events:
+            for dijkstra in self.dijkstras.values():
+                self.game_events.unregister_listener(dijkstra)
+        for dijkstra in self.dijkstras.values():
+            dijkstra.attractors = [x for x in dijkstra.attractors if self.is_placed(x)]
+
+    def is_placed(self, item):
+        """
+        Return True if the item is where it thinks it is on this map
+        :param item: MapItem
+        :return: bool
+        """
+        return item.map is self and self.get_item(layer=item.layer, location=item.location) is item
+
     def rebuild_dijkstras(self):
         """
         This method should be called after MapFactory has finished building this map
@@ -229,6 +289,34 @@ class RLMap(object):
         for x in self.dijkstras.values():
             x.rebuild_self()
 
+    #  Dirty cell tracking
+
+    def track_dirty_cells(self):
+        """
+        Start remembering which cells were changed by add_item(), delete_item() and move_item().
+        Calling it again doesn't reset the cells already remembered
+        :return:
+        """
+        if self.dirty_cells is None:
+            self.dirty_cells = {layer: set() for layer in self.layers}
+
+    def consume_dirty_cells(self, layers=None):
+        """
+        Return the cells changed since the previous call and forget them.
+        Meant to be called once per turn (eg after the animations are over) by whatever redraws the map.
+        There is a single set per layer, so if several consumers need the same layer, one of them should pass
+        the cells on to the others. Starts tracking if it wasn't started yet; the first call then returns
+        empty sets
+        :param layers: list of layer names. If None, all layers are consumed
+        :return: dict of {layer: set of (x, y)}
+        """
+        self.track_dirty_cells()
+        r = {}
+        for layer in layers if layers is not None else self.layers:
+            r[layer] = self.dirty_cells[layer]
+            self.dirty_cells[layer] = set()
+        return r
+
     #  Actions on map items: addition, removal and so on
 
     def move_item(self, layer='default', old_location=(0, 0), new_location=(1, 1)):
@@ -242,6 +330,9 @@ class RLMap(object):
         moved_item=self.get_item(layer=layer, location=old_location)
         self.items[layer][new_location[0]][new_location[1]] = moved_item
         self.items[layer][old_location[0]][old_location[1]] = None
+        if self.dirty_cells is not None:
+            self.dirty_cells[layer].add((old_location[0], old_location[1]))
+            self.dirty_cells[layer].add((new_location[0], new_location[1]))
 
     def get_item(self, layer='default', location=(0, 0)):
         """
@@ -278,6 +369,11 @@ class RLMap(object):
         :return:
         """
         self.items[layer][location[0]][location[1]] = item
+        if self.dirty_cells is not None:
+            self.dirty_cells[layer].add((location[0], location[1]))
+        if item is None or item.shared:
+            #  Shared items don't know where they are and don't make turns
+            return
         if isinstance(item, Actor) or isinstance(item, Construction):
             item.connect_to_map(map=self, location=location, layer=layer)
         if isinstance(item, Actor):
@@ -314,9 +410,11 @@ class RLMap(object):
         item = self.items[layer][location[0]][location[1]]
         if isinstance(item, Actor):
             self.actors.remove(item)
-        if isinstance(item, Construction):
+        if isinstance(item, Construction) and not item.shared:
             self.constructions.remove(item)
         self.items[layer][location[0]][location[1]] = None
+        if self.dirty_cells is not None:
+            self.dirty_cells[layer].add((location[0], location[1]))
         #  If no other references exist (when this executes, one should probably be in GameEvent)
         #  Actor object will be garbage-collected. Please note that this method does not handle
         #  widget deletion. That one should be called according to GameEvent somehow
@@ -396,10 +494,11 @@ class RLMap(object):
             for y in range(yrange[0], yrange[1]):
                 for l in layers:
                     i = self.get_item(location=(x, y), layer=l)
-                    if i:
+                    if i and not i.shared:
                         neighbours[i] = None
         #  Select air-reachable items. Relies on item having `location` attribute and thus makes sense
-        #  only for Actors and Constructions (as of now)
+        #  only for Actors and Constructions (as of now). Shared items have no location, but they don't
+        #  have fighter components either, so there is no point in shooting them
         for item in neighbours.keys():
             line = self.get_line(location, item.location)
             if line[-1] == item.location and (len(line) > 2 or not exlcude_neighbours):
@@ -521,18 +620,31 @@ class RLMap(object):
         successful, does the same for all the actors and constructions (in that order). Then it calls for animation
         to be drawn, even if PC turn wasn't actually possible. That's because calling for impossible turn could've
         potentially updated game log or caused other visible effects.
+        If game manager has profiler enabled, every phase of the turn is timed.
         :return:
         """
+        profiler = self.game_manager.profiler
+        profiler.start_turn()
         self.actors[0].controller.accept_command(command)
         r = self.actors[0].make_turn()
+        profiler.end_phase('pc')
         if r:
             # This is sorta ugly, but Dijkstras are rebuilt only when the queue starts processing and that happens
             # only at the turn's end. Thus, enemies act using outdated information (especially re:PC position)
             # Proper real-time queue might be better, but this thing is simple enough and does not require heavy
             # refactoring
             self.rebuild_dijkstras()
+            profiler.end_phase('dijkstra')
             for a in self.actors[1:]:
+                start = profiler.clock()
                 a.make_turn()
+                profiler.add_actor_time(a, start)
+            profiler.end_phase('ai')
             for a in self.constructions:
+                start = profiler.clock()
                 a.make_turn()
+                profiler.add_actor_time(a, start)
+            profiler.end_phase('constructions')
         self.game_events.pass_all_events()
+        profiler.end_phase('events')
+        profiler.end_turn()
@@ -3,26 +3,85 @@ Map item classes. This module contains the base MapItem class and its primitive
 More complex MapItems are in their own files
 """
 
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_slots(cls):
+    """
+    Return names of all the slots of a class, including inherited ones
+    :param cls: type
+    :return: tuple of str
+    """
+    r = []
+    for c in reversed(cls.__mro__):
+        for name in c.__dict__.get('__slots__', ()):
+            if name not in r:
+                r.append(name)
+    return tuple(r)
+
 
 class MapItem(object):
     """
-    Base class from which all items that can be placed on map should inherit
+    Base class from which all items that can be placed on map should inherit.
+    Map items are slotted, because there can be tens of thousands of them. Every subclass should declare its
+    attributes in __slots__ (an empty tuple if it has none), otherwise its instances get a __dict__ again.
+    Attributes that some other code checks with hasattr() should be given a default value in __init__, so that
+    they can be pickled consistently
     """
+    __slots__ = ('passable', 'air_passable', 'image_source', 'widget', 'shared')
+
     def __init__(self, passable=True, air_passable=None, image_source=None):
         self.passable = passable
         if air_passable:
             self.air_passable = air_passable
         else:
             self.air_passable = self.passable
+        self.image_source = image_source
         self.widget = None
+        #  True for flyweights: items that have no per-cell state and are placed in many cells at once, such as
+        #  ground tiles. Shared items are never connected to a map and are never given widgets, so they should
+        #  only be placed on layers drawn by a BatchedLayerWidget
+        self.shared = False
+
+    def clone(self):
+        """
+        Return a copy of this item made without calling __init__. Used to create items from prototypes, see
+        MapItemDepot. Slot values are copied as is, so the copy shares every object the original refers to;
+        subclasses replace the references that shouldn't be shared, such as components.
+        Shared items are not copied
+        :return: MapItem
+        """
+        if self.shared:
+            return self
+        r = object.__new__(type(self))
+        for name in get_slots(type(self)):
+            setattr(r, name, getattr(self, name))
+        r.widget = None
+        return r
 
     def collide(self, other):
         """ Collisions are expected to be overridden if they are to actually do something.
         This method returns False indicating that nothing happened."""
         return False
 
+    def __getstate__(self):
+        """
+        Pickle everything except the widget, which belongs to the interface and cannot be pickled
+        :return:
+        """
+        state = {name: getattr(self, name) for name in get_slots(type(self)) if hasattr(self, name)}
+        state['widget'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
 
 class GroundTile(MapItem):
+    __slots__ = ()
+
     def __init__(self, passable=True, image_source='Tmp_frame.png', **kwargs):
         super(GroundTile, self).__init__(**kwargs)
         self.passable = passable
@@ -0,0 +1,193 @@
+"""
+Map residency manager.
+Once built, a map stays in MapLoader.maps with all its tiles, actors and Dijkstra maps, so memory use grows with
+every map visited. MapResidency keeps only the most recently used maps in memory and saves the rest to disk as
+compressed pickles. Getting an evicted map restores it from its snapshot, with all actors and constructions
+in the state they were in when the map was evicted.
+Maps are evicted only when another map is used, and a map is only used by GameManager after the previous one
+has been left (see GameManager.switch_map()), so the current map is never evicted.
+
+Usage: python3 MapResidency.py [level_file] [capacity]
+Visits every map of a level twice and compares memory use and access times with and without eviction.
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+import zlib
+from collections import OrderedDict
+from time import perf_counter
+
+
+class MapResidency(object):
+    """
+    A dict-like container of maps by ID that keeps at most `capacity` maps in memory.
+    Every access to a map in memory is a hit; every access to an evicted map is a miss, which restores the map
+    from its snapshot. Snapshot and restore times are recorded for self.report()
+    """
+    def __init__(self, capacity=None, directory=None):
+        #  Maximum number of maps kept in memory. None means no limit, ie nothing is ever evicted
+        self.capacity = capacity
+        #  Directory for snapshots. If None, a temporary directory is created with the first snapshot
+        #  and removed at exit. A given directory may be shared by several instances
+        self.directory = directory
+        self._temporary_directory = None
+        #  Maps in memory, least recently used first
+        self.resident = OrderedDict()
+        #  {map_id: snapshot filename} for evicted maps
+        self.snapshots = {}
+        self.hits = 0
+        self.misses = 0
+        #  Durations of every eviction and restore, in seconds
+        self.snapshot_times = []
+        self.restore_times = []
+        self.snapshot_bytes = 0
+
+    def __contains__(self, map_id):
+        return map_id in self.resident or map_id in self.snapshots
+
+    def __len__(self):
+        return len(self.resident) + len(self.snapshots)
+
+    def __iter__(self):
+        yield from list(self.resident.keys())
+        yield from list(self.snapshots.keys())
+
+    def keys(self):
+        return list(self)
+
+    def is_resident(self, map_id):
+        """
+        Return True if the map is in memory
+        :param map_id: str
+        :return: bool
+        """
+        return map_id in self.resident
+
+    def __getitem__(self, map_id):
+        try:
+            map = self.resident[map_id]
+        except KeyError:
+            if map_id not in self.snapshots:
+                raise
+            self.misses += 1
+            map = self._restore(map_id)
+            self.resident[map_id] = map
+            self._evict_extra()
+            return map
+        self.hits += 1
+        self.resident.move_to_end(map_id)
+        return map
+
+    def __setitem__(self, map_id, map):
+        if map_id in self.snapshots:
+            os.remove(self.snapshots.pop(map_id))
+        self.resident[map_id] = map
+        self.resident.move_to_end(map_id)
+        self._evict_extra()
+
+    def _evict_extra(self):
+        """
+        Evict least recently used maps until there are at most self.capacity maps in memory
+        :return:
+        """
+        if self.capacity is None:
+            return
+        while len(self.resident) > max(self.capacity, 1):
+            map_id, map = self.resident.popitem(last=False)
+            self._snapshot(map_id, map)
+
+    def _get_directory(self):
+        if self.directory is None:
+            self._temporary_directory = tempfile.TemporaryDirectory(prefix='camp_maps_')
+            self.directory = self._temporary_directory.name
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    def _snapshot(self, map_id, map):
+        """
+        Save a map to disk and forget it
+        :param map_id: str
+        :param map: RLMap
+        :return:
+        """
+        start = perf_counter()
+        data = zlib.compress(pickle.dumps(map, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        #  Map IDs come from the level file, so they are not used as filenames as is. Names are unique, because
+        #  the directory may be shared with other loaders
+        descriptor, filename = tempfile.mkstemp(suffix='.pickle.z', prefix='map_', dir=self._get_directory())
+        with os.fdopen(descriptor, mode='wb') as snapshot_file:
+            snapshot_file.write(data)
+        self.snapshots[map_id] = filename
+        self.snapshot_bytes += len(data)
+        self.snapshot_times.append(perf_counter() - start)
+
+    def _restore(self, map_id):
+        """
+        Load a map from its snapshot and delete the snapshot
+        :param map_id: str
+        :return: RLMap
+        """
+        start = perf_counter()
+        filename = self.snapshots.pop(map_id)
+        with open(filename, mode='rb') as snapshot_file:
+            map = pickle.loads(zlib.decompress(snapshot_file.read()))
+        os.remove(filename)
+        self.restore_times.append(perf_counter() - start)
+        return map
+
+    def report(self):
+        """
+        Return a human-readable summary of map residency
+        :return: str
+        """
+        r = 'Map residency: {0} maps in memory, {1} on disk (capacity {2})\n'.format(
+            len(self.resident), len(self.snapshots), 'unlimited' if self.capacity is None else self.capacity)
+        total = self.hits + self.misses
+        r += '{0} hits, {1} misses ({2:.1%} hit rate)'.format(self.hits, self.misses,
+                                                             self.hits / total if total else 0)
+        if self.snapshot_times:
+            r += '\n{0} snapshots, {1:.1f} KB average, {2:.2f} ms average, {3:.2f} ms max'.format(
+                len(self.snapshot_times), self.snapshot_bytes / len(self.snapshot_times) / 1024,
+                sum(self.snapshot_times) / len(self.snapshot_times) * 1000, max(self.snapshot_times) * 1000)
+        if self.restore_times:
+            r += '\n{0} restores, {1:.2f} ms average, {2:.2f} ms max'.format(
+                len(self.restore_times), sum(self.restore_times) / len(self.restore_times) * 1000,
+                max(self.restore_times) * 1000)
+        return r
+
+
+def benchmark(source, capacity=4):
+    """
+    Get every map from a level file twice, in order, once keeping all maps in memory and once with eviction.
+    Reports the memory taken by the maps after the last access, and residency stats
+    :param source: str. Level filename
+    :param capacity: int
+    :return: str
+    """
+    from Factories import MapLoader
+    from Profiling import measure_memory
+    lines = []
+    for name, max_resident_maps in (('all resident', None), ('capacity {0}'.format(capacity), capacity)):
+        loader = MapLoader(max_resident_maps=max_resident_maps)
+        loader.read_map_file(source)
+        map_ids = list(loader.map_index.keys())
+
+        def visit_maps():
+            for map_id in map_ids * 2:
+                loader.get_map_by_id(map_id)
+
+        start = perf_counter()
+        size, r = measure_memory(visit_maps)
+        duration = perf_counter() - start
+        lines.append('{0}: {1} maps visited twice in {2:.0f} ms (under tracemalloc), {3:.1f} MB in use'.format(
+            name, len(map_ids), duration * 1000, size / 2**20))
+        lines.append(loader.maps.report())
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(benchmark(sys.argv[1] if len(sys.argv) > 1 else 'test_level.lvl',
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 4))
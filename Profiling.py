@@ -0,0 +1,409 @@
+"""
+Performance instrumentation for turn processing.
+TurnProfiler splits every RLMap.process_turn() call into phases and keeps the timings for a rolling window
+of recent turns. It is disabled by default and costs a couple of method calls per actor when disabled.
+SlowTurnWatchdog saves a profile and a map snapshot for every turn that took longer than a given budget.
+actor_memory_benchmark() measures how much memory map entities take.
+StartupProfiler records how long it takes the game to show the first frame and to load all assets.
+import_profile() reports which modules take the longest to import, and whether kivy is among them.
+
+Usage: python3 Profiling.py [actor_count]
+       python3 Profiling.py imports [module]
+"""
+
+import cProfile
+import gc
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tracemalloc
+from collections import deque
+from time import perf_counter_ns
+
+from RandomStreams import get_state
+from Tracing import tracer
+
+
+class TurnStats(object):
+    """
+    Rolling-window statistics for turn phase timings.
+    Every turn is stored as a dict of {phase: nanoseconds} and a dict of {class name: nanoseconds}
+    for the per-controller breakdown. Only the last `window` turns are kept.
+    """
+    def __init__(self, window=100):
+        self.turns = deque(maxlen=window)
+        self.breakdowns = deque(maxlen=window)
+
+    def add_turn(self, phases, breakdown):
+        """
+        Add a single turn
+        :param phases: dict of {phase: ns}
+        :param breakdown: dict of {class name: ns}
+        :return:
+        """
+        self.turns.append(phases)
+        self.breakdowns.append(breakdown)
+
+    def clear(self):
+        self.turns.clear()
+        self.breakdowns.clear()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def _values(self, phase):
+        """
+        Return sorted timings for a phase. phase 'total' is the sum of all phases of a turn
+        :param phase: str
+        :return: list of int
+        """
+        if phase == 'total':
+            return sorted(sum(x.values()) for x in self.turns)
+        return sorted(x.get(phase, 0) for x in self.turns)
+
+    def mean(self, phase='total'):
+        """
+        Mean duration of a phase within the window, in ns
+        :param phase: str
+        :return: float
+        """
+        values = self._values(phase)
+        return sum(values) / len(values) if values else 0
+
+    def maximum(self, phase='total'):
+        """
+        Maximum duration of a phase within the window, in ns
+        :param phase: str
+        :return: int
+        """
+        values = self._values(phase)
+        return values[-1] if values else 0
+
+    def percentile(self, phase='total', percent=95):
+        """
+        Nearest-rank percentile of a phase duration within the window, in ns
+        :param phase: str
+        :param percent: number between 0 and 100
+        :return: int
+        """
+        values = self._values(phase)
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def breakdown_mean(self):
+        """
+        Mean per-turn time spent in every actor or construction class within the window, in ns
+        :return: dict of {class name: float}
+        """
+        r = {}
+        for breakdown in self.breakdowns:
+            for name, value in breakdown.items():
+                r[name] = r.get(name, 0) + value
+        return {name: value / len(self.breakdowns) for name, value in r.items()}
+
+    def report(self):
+        """
+        Return a human-readable table of phase timings
+        :return: str
+        """
+        if not self.turns:
+            return 'No turns profiled'
+        lines = ['Last {0} turns, ms: mean / 95% / max'.format(len(self.turns))]
+        for phase in TurnProfiler.phases + ('total',):
+            lines.append('{0:>14} {1:8.3f} {2:8.3f} {3:8.3f}'.format(phase,
+                                                                     self.mean(phase) / 1e6,
+                                                                     self.percentile(phase) / 1e6,
+                                                                     self.maximum(phase) / 1e6))
+        breakdown = self.breakdown_mean()
+        for name in sorted(breakdown, key=lambda x: -breakdown[x]):
+            lines.append('{0:>30} {1:8.3f}'.format(name, breakdown[name] / 1e6))
+        return '\n'.join(lines)
+
+
+class TurnProfiler(object):
+    """
+    Phase timer for RLMap.process_turn().
+    The map calls start_turn(), then end_phase() after each phase, and end_turn(). Each end_phase() adds the
+    time since the previous mark to that phase. Individual actor turns are timed with clock() and
+    add_actor_time() to build a breakdown by controller class.
+    Setting self.enabled takes effect from the next turn.
+    When Tracing.tracer is enabled, phases and actor turns are also recorded as trace spans, whether the
+    profiler itself is enabled or not.
+    """
+    phases = ('pc', 'dijkstra', 'ai', 'constructions', 'events')
+
+    def __init__(self, window=100):
+        self.enabled = False
+        self.stats = TurnStats(window=window)
+        #  Data for the turn currently being profiled. None if the turn is not profiled
+        self._phases = None
+        self._breakdown = None
+        self._last_mark = 0
+        self._turn_start = 0
+        self._tracing = False
+
+    def start_turn(self):
+        self._tracing = tracer.enabled
+        if self.enabled or self._tracing:
+            self._phases = {}
+            self._breakdown = {}
+            self._turn_start = self._last_mark = perf_counter_ns()
+
+    def end_phase(self, phase):
+        """
+        Add the time elapsed since the last mark to a given phase
+        :param phase: str, one of self.phases
+        :return:
+        """
+        if self._phases is not None:
+            now = perf_counter_ns()
+            self._phases[phase] = self._phases.get(phase, 0) + now - self._last_mark
+            if self._tracing:
+                tracer.complete(phase, category='turn', start=self._last_mark, end=now)
+            self._last_mark = now
+
+    def clock(self):
+        """
+        Return current time if the turn is profiled, 0 otherwise
+        :return: int
+        """
+        if self._phases is not None:
+            return perf_counter_ns()
+        return 0
+
+    def add_actor_time(self, actor, start):
+        """
+        Add the time elapsed since `start` to the breakdown entry for actor's controller class.
+        Actors without a controller (eg most constructions) are accounted under their own class name
+        :param actor: Actor or Construction
+        :param start: int, value returned by self.clock()
+        :return:
+        """
+        if self._breakdown is not None:
+            if actor.controller:
+                name = type(actor.controller).__name__
+            else:
+                name = type(actor).__name__
+            now = perf_counter_ns()
+            self._breakdown[name] = self._breakdown.get(name, 0) + now - start
+            if self._tracing:
+                tracer.complete(name, category='actor', start=start, end=now)
+
+    def end_turn(self):
+        if self._phases is not None:
+            if self.enabled:
+                self.stats.add_turn(self._phases, self._breakdown)
+            if self._tracing:
+                tracer.complete('turn', category='turn', start=self._turn_start)
+            self._phases = None
+            self._breakdown = None
+
+    def toggle(self):
+        """
+        Switch profiling on or off. Stats are kept when profiling is switched off
+        :return: bool. New value of self.enabled
+        """
+        self.enabled = not self.enabled
+        return self.enabled
+
+
+class SlowTurnWatchdog(object):
+    """
+    A wrapper around RLMap.process_turn() that catches unusually long turns.
+    Before every turn the map and random stream states are pickled, and the turn itself runs under cProfile.
+    If the turn takes longer than the budget, a directory is created in output_dir with the following files:
+    profile.prof  cProfile stats of the turn (readable with pstats or snakeviz)
+    snapshot.pickle  map and random stream states before the turn (see Replay.rerun_slow_turn)
+    turn.json  the command that started the turn, its duration and the map ID
+    Snapshotting and profiling are expensive, so the watchdog should only be attached when hunting for outliers.
+    """
+    def __init__(self, budget_ms=50, output_dir='slow_turns'):
+        self.budget_ms = budget_ms
+        self.output_dir = output_dir
+        self.turn_number = 0
+        #  Directories written so far
+        self.captured = []
+
+    def process_turn(self, map, command):
+        """
+        Make a turn on the map, saving the artifacts if it takes too long
+        :param map: RLMap
+        :param command: Command
+        :return:
+        """
+        self.turn_number += 1
+        snapshot = pickle.dumps({'map': map, 'random_state': get_state()})
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            #  Another profiler (eg the whole game running under cProfile) is already active
+            profile = None
+        start = perf_counter_ns()
+        try:
+            map.process_turn(command=command)
+        finally:
+            duration_ms = (perf_counter_ns() - start) / 1e6
+            if profile:
+                profile.disable()
+        if duration_ms > self.budget_ms:
+            self._save(map, command, duration_ms, snapshot, profile)
+
+    def _save(self, map, command, duration_ms, snapshot, profile):
+        """
+        Write the artifacts of a slow turn to disk
+        :return:
+        """
+        directory = os.path.join(self.output_dir, 'turn_{0}_{1}ms'.format(self.turn_number, int(duration_ms)))
+        os.makedirs(directory, exist_ok=True)
+        if profile:
+            profile.dump_stats(os.path.join(directory, 'profile.prof'))
+        with open(os.path.join(directory, 'snapshot.pickle'), mode='wb') as snapshot_file:
+            snapshot_file.write(snapshot)
+        with open(os.path.join(directory, 'turn.json'), mode='w') as turn_file:
+            json.dump({'turn_number': self.turn_number,
+                       'map_id': map.map_id,
+                       'duration_ms': duration_ms,
+                       'budget_ms': self.budget_ms,
+                       'command_type': command.command_type,
+                       'command_value': command.command_value},
+                      turn_file)
+        self.captured.append(directory)
+        print('Slow turn ({0:.1f} ms) saved to {1}'.format(duration_ms, directory))
+
+
+class StartupProfiler(object):
+    """
+    Timestamps of startup milestones, counted from the creation of the profiler.
+    There is a single profiler, Profiling.startup_profiler, created when this module is first imported. camp.py
+    imports it before kivy, so that kivy import time is included
+    """
+    def __init__(self):
+        self.start = perf_counter_ns()
+        #  (milestone, nanoseconds since start) tuples, in order
+        self.marks = []
+
+    def mark(self, name):
+        """
+        Remember that a milestone was reached now
+        :param name: str
+        :return:
+        """
+        self.marks.append((name, perf_counter_ns() - self.start))
+
+    def elapsed(self, name):
+        """
+        Return the time from start to a given milestone, in milliseconds, or None if it wasn't reached
+        :param name: str
+        :return: float
+        """
+        for mark, time in self.marks:
+            if mark == name:
+                return time / 1000000
+        return None
+
+    def report(self):
+        """
+        Return a human-readable list of milestones with the time to each of them and the time since the previous one
+        :return: str
+        """
+        lines = ['Startup profile:']
+        previous = 0
+        for mark, time in self.marks:
+            lines.append('{0:>20} {1:8.1f} ms (+{2:.1f} ms)'.format(mark, time / 1000000,
+                                                                   (time - previous) / 1000000))
+            previous = time
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        """
+        Append the milestones to a file as a single JSON line, so that startup times can be tracked across runs
+        :param filename: str
+        :return:
+        """
+        with open(filename, mode='a') as profile_file:
+            profile_file.write(json.dumps({mark: time / 1000000 for mark, time in self.marks}) + '\n')
+
+
+#  The profiler that is started at import
+startup_profiler = StartupProfiler()
+
+
+def import_profile(module='GameManager', top=10):
+    """
+    Import a module in a fresh interpreter with `-X importtime` and report the slowest imports.
+    Also tells if kivy was imported, which the simulation modules shouldn't do
+    :param module: str
+    :param top: int. Number of modules to list
+    :return: str
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import sys, {0}; print(any(x.startswith("kivy") for x in sys.modules))'.format(module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return 'Cannot import {0}:\n{1}'.format(module, result.stderr)
+    #  Lines look like 'import time:  self [us] | cumulative | imported package'
+    times = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(self_time), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative)
+    lines = ['import {0}: {1:.1f} ms, kivy {2}imported'.format(module, total / 1000,
+                                                             '' if result.stdout.strip() == 'True' else 'not ')]
+    for self_time, name in sorted(times, reverse=True)[:top]:
+        lines.append('{0:>30} {1:8.1f} ms'.format(name, self_time / 1000))
+    return '\n'.join(lines)
+
+
+def measure_memory(function):
+    """
+    Call a function and return the amount of memory allocated by it that is still in use after it returns,
+    along with the function's return value. Uses tracemalloc, so it's slow and is only meant for benchmarks
+    :param function: callable without arguments
+    :return: (bytes, return value) tuple
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        r = function()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - start, r
+    finally:
+        tracemalloc.stop()
+
+
+def actor_memory_benchmark(count=10000):
+    """
+    Place `count` actors (chassis, gunners and melee units in equal numbers) on a map and report how much memory
+    they take, including their components, controllers and inventories
+    :param count: int
+    :return: str
+    """
+    from Factories import depot
+    from Map import RLMap
+    side = int(count ** 0.5) + 1
+    map = RLMap(size=(side, side), layers=['bg', 'constructions', 'items', 'actors'])
+    makers = (depot.make_chassis, depot.make_gunner, depot.make_melee)
+
+    def place_actors():
+        for i in range(count):
+            map.add_item(makers[i % len(makers)](), layer='actors', location=(i % side, i // side))
+
+    size, r = measure_memory(place_actors)
+    return '{0} actors: {1:.1f} MB, {2:.0f} bytes per actor'.format(count, size / 2**20, size / count)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'imports':
+        print(import_profile(*sys.argv[2:3]))
+    else:
+        print(actor_memory_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000))
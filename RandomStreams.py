@@ -0,0 +1,81 @@
+"""
+Named random number streams.
+Every subsystem that needs randomness (AI, combat, spawning, effects) draws from its own random.Random
+instance instead of the global one. When the streams are seeded, the game becomes deterministic: the same seed
+and the same sequence of player commands always produce the same game. Streams are independent, so adding a
+random call to, say, the AI doesn't change what the spawners produce.
+"""
+
+import random
+
+#  All streams created so far. Keys are subsystem names, values are random.Random instances
+_streams = {}
+#  Master seed. If None, streams are seeded from system randomness
+_seed = None
+
+
+def _stream_seed(name):
+    """
+    Return the seed for a named stream, derived from the master seed.
+    String seeds are hashed by random.Random itself in a way that doesn't depend on PYTHONHASHSEED
+    :param name: str
+    :return:
+    """
+    if _seed is None:
+        return None
+    return '{0}:{1}'.format(_seed, name)
+
+
+def get_stream(name):
+    """
+    Return the random.Random instance for a given subsystem, creating it if necessary.
+    Callers should not cache the result across seed_streams() calls; streams are reseeded in place, so holding
+    a reference is safe, but it's simpler to just call this function every time.
+    :param name: str. Subsystem name, eg 'ai' or 'combat'
+    :return: random.Random
+    """
+    try:
+        return _streams[name]
+    except KeyError:
+        stream = random.Random(_stream_seed(name))
+        _streams[name] = stream
+        return stream
+
+
+def seed_streams(seed):
+    """
+    Set the master seed and reseed all existing streams.
+    Streams created later are seeded from the same master seed.
+    :param seed: int, str or None. None returns the streams to system randomness
+    :return:
+    """
+    global _seed
+    _seed = seed
+    for name, stream in _streams.items():
+        stream.seed(_stream_seed(name))
+
+
+def get_state():
+    """
+    Return the internal state of all streams, so that they can be rewound with set_state()
+    :return: dict of {name: state}
+    """
+    return {name: stream.getstate() for name, stream in _streams.items()}
+
+
+def set_state(state):
+    """
+    Restore the stream states returned by get_state()
+    :param state: dict of {name: state}
+    :return:
+    """
+    for name, stream_state in state.items():
+        get_stream(name).setstate(stream_state)
+
+
+def get_seed():
+    """
+    Return the current master seed (None if streams are not seeded)
+    :return:
+    """
+    return _seed
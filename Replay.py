@@ -0,0 +1,265 @@
+"""
+Session recording and deterministic replay.
+A session is the random seed, the map file and the list of PC commands. Since all game randomness comes from
+seeded RandomStreams, replaying the commands on a fresh GameManager reproduces the game exactly. The state hash
+is recorded after every turn, so the replayer can tell where (if anywhere) the replay diverged. Replayer also
+times every turn, so that recorded sessions can be used as benchmarks.
+
+If max_resident_maps is given, the session is replayed with map eviction, and then replayed once more with
+all maps in memory and once with eviction, comparing the states of the two runs after every turn.
+
+Slow turns saved by Profiling.SlowTurnWatchdog can be re-run from their snapshots as well.
+
+Usage: python3 Replay.py session.json [max_resident_maps]
+       python3 Replay.py slow_turns/turn_N_Mms [map_file]
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+from time import perf_counter
+
+from Controller import Command
+from GameManager import GameManager
+from Listeners import DeathListener, BorderWalkListener, TutorialListener
+from RandomStreams import set_state
+
+
+def state_hash(map):
+    """
+    Return a hash of the map state.
+    Includes everything that a turn could change: positions and stats of actors and constructions,
+    items on the ground and in actors' inventories
+    :param map: RLMap
+    :return: str
+    """
+    state = [map.map_id, tuple(map.size)]
+    for actor in map.actors:
+        state.append((type(actor).__name__, tuple(actor.location),
+                      actor.fighter.hp if actor.fighter else None,
+                      actor.fighter.ammo if actor.fighter else None,
+                      actor.breath.breath if actor.breath else None,
+                      tuple(i.name for i in actor.inventory) if actor.inventory else None))
+    for construction in map.constructions:
+        state.append((type(construction).__name__, tuple(construction.location),
+                      construction.fighter.hp if construction.fighter else None))
+    for x in range(map.size[0]):
+        for y in range(map.size[1]):
+            item = map.get_item(layer='items', location=(x, y))
+            if item:
+                state.append((item.name, x, y))
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+
+def start_session(map_file='test_level.lvl', seed=None, start_map='entrance', max_resident_maps=None):
+    """
+    Create and start a headless game, the same way CampApp does it, minus the widgets
+    :param map_file: str
+    :param seed: master seed for RandomStreams
+    :param start_map: str. ID of the first map
+    :param max_resident_maps: int or None. Passed to GameManager
+    :return: GameManager
+    """
+    game_manager = GameManager(map_file=map_file, seed=seed, max_resident_maps=max_resident_maps)
+    game_manager.switch_map(start_map)
+    _register_listeners(game_manager)
+    game_manager.queue.pass_all_events()
+    return game_manager
+
+
+def _register_listeners(game_manager):
+    """
+    Register the same universal listeners as CampApp does
+    :param game_manager: GameManager
+    :return:
+    """
+    game_manager.register_listener(DeathListener())
+    game_manager.register_listener(BorderWalkListener())
+    game_manager.register_listener(TutorialListener())
+
+
+def rerun_slow_turn(directory, map_file='test_level.lvl'):
+    """
+    Re-run a turn captured by SlowTurnWatchdog.
+    The map from the snapshot replaces its namesake in a fresh game, random streams are rewound to the state
+    they had before the turn, and the recorded command is executed.
+    Map file is necessary, because neighbouring maps may be entered during the turn.
+    :param directory: str. Directory created by the watchdog
+    :param map_file: str
+    :return: float. Turn duration in seconds
+    """
+    with open(os.path.join(directory, 'snapshot.pickle'), mode='rb') as snapshot_file:
+        snapshot = pickle.load(snapshot_file)
+    with open(os.path.join(directory, 'turn.json')) as turn_file:
+        turn = json.load(turn_file)
+    game_manager = GameManager(map_file=map_file)
+    game_manager.map_loader.maps[snapshot['map'].map_id] = snapshot['map']
+    game_manager.switch_map(snapshot['map'].map_id)
+    _register_listeners(game_manager)
+    game_manager.queue.pass_all_events()
+    set_state(snapshot['random_state'])
+    start = perf_counter()
+    game_manager.process_turn(SessionReplayer._make_command(turn))
+    return perf_counter() - start
+
+
+class SessionRecorder(object):
+    """
+    Remembers the seed and every PC command of a game session, along with the state hash after every turn.
+    To be attached as GameManager.recorder. The game should be started with a known seed, otherwise
+    it cannot be replayed.
+    """
+    def __init__(self, game_manager=None, start_map='entrance'):
+        if game_manager.seed is None:
+            raise ValueError('Cannot record a session that was started without a seed')
+        self.game_manager = game_manager
+        self.start_map = start_map
+        self.turns = []
+
+    def record_turn(self, command):
+        """
+        Remember a command and the resulting state hash
+        :param command: Command
+        :return:
+        """
+        self.turns.append({'command_type': command.command_type,
+                           'command_value': command.command_value,
+                           'state_hash': state_hash(self.game_manager.map)})
+
+    def save(self, filename):
+        """
+        Write the session to a JSON file
+        :param filename: str
+        :return:
+        """
+        with open(filename, mode='w') as session_file:
+            json.dump({'seed': self.game_manager.seed,
+                       'map_file': self.game_manager.map_file,
+                       'start_map': self.start_map,
+                       'turns': self.turns},
+                      session_file)
+
+
+class SessionReplayer(object):
+    """
+    Replays a recorded session without interface, checking state hashes and timing every turn
+    """
+    def __init__(self, filename):
+        with open(filename) as session_file:
+            session = json.load(session_file)
+        self.seed = session['seed']
+        self.map_file = session['map_file']
+        self.start_map = session['start_map']
+        self.turns = session['turns']
+        #  Results of the last replay
+        self.turn_times = []
+        self.mismatch = None
+        self.game_manager = None
+
+    @staticmethod
+    def _make_command(turn):
+        """
+        Restore a Command from its recorded form
+        JSON turns tuples into lists, and some game code compares locations to tuples, so values are
+        converted back
+        :param turn: dict
+        :return: Command
+        """
+        value = turn['command_value']
+        if value is not None:
+            value = tuple(value)
+        return Command(command_type=turn['command_type'], command_value=value)
+
+    def replay(self, stop_on_mismatch=True, max_resident_maps=None):
+        """
+        Replay the session.
+        Returns True if all state hashes matched. The number of the first mismatched turn is stored in
+        self.mismatch, and turn durations (in seconds) are stored in self.turn_times
+        :param stop_on_mismatch: bool. If False, replay continues after the first mismatch (for benchmarking)
+        :param max_resident_maps: int or None. If set, maps are evicted to disk, which shouldn't change the game
+        :return: bool
+        """
+        self.turn_times = []
+        self.mismatch = None
+        game_manager = start_session(map_file=self.map_file, seed=self.seed, start_map=self.start_map,
+                                     max_resident_maps=max_resident_maps)
+        self.game_manager = game_manager
+        for number, turn in enumerate(self.turns):
+            command = self._make_command(turn)
+            start = perf_counter()
+            game_manager.process_turn(command)
+            self.turn_times.append(perf_counter() - start)
+            if self.mismatch is None and state_hash(game_manager.map) != turn['state_hash']:
+                self.mismatch = number
+                if stop_on_mismatch:
+                    break
+        return self.mismatch is None
+
+    def compare_residency(self, max_resident_maps=1):
+        """
+        Replay the session twice, once keeping all maps in memory and once keeping at most max_resident_maps
+        of them, and compare state hashes after every turn. Evicting maps to disk and restoring them shouldn't
+        change the game, so they should never differ
+        :param max_resident_maps: int
+        :return: int or None. The number of the first turn after which the states differ
+        """
+        hashes = []
+        for capacity in (None, max_resident_maps):
+            game_manager = start_session(map_file=self.map_file, seed=self.seed, start_map=self.start_map,
+                                         max_resident_maps=capacity)
+            run_hashes = []
+            for turn in self.turns:
+                game_manager.process_turn(self._make_command(turn))
+                run_hashes.append(state_hash(game_manager.map))
+            hashes.append(run_hashes)
+        for number, (unlimited, limited) in enumerate(zip(*hashes)):
+            if unlimited != limited:
+                return number
+        return None
+
+    def report(self):
+        """
+        Return a human-readable summary of the last replay
+        :return: str
+        """
+        if not self.turn_times:
+            return 'No turns replayed'
+        times = sorted(self.turn_times)
+        r = 'Replayed {0} of {1} turns: '.format(len(times), len(self.turns))
+        if self.mismatch is None:
+            r += 'state hashes match\n'
+        else:
+            r += 'state diverged at turn {0}\n'.format(self.mismatch)
+        r += 'Total {0:.1f} ms, mean {1:.2f} ms, median {2:.2f} ms, 95th percentile {3:.2f} ms, max {4:.2f} ms'.format(
+            sum(times) * 1000,
+            sum(times) / len(times) * 1000,
+            times[len(times) // 2] * 1000,
+            times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+            times[-1] * 1000)
+        return r
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: {0} session.json | slow_turn_dir [map_file]\n'.format(sys.argv[0]))
+        sys.exit(2)
+    if os.path.isdir(sys.argv[1]):
+        duration = rerun_slow_turn(sys.argv[1], *sys.argv[2:3])
+        print('Turn took {0:.2f} ms'.format(duration * 1000))
+        sys.exit(0)
+    replayer = SessionReplayer(sys.argv[1])
+    max_resident_maps = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    matched = replayer.replay(max_resident_maps=max_resident_maps)
+    print(replayer.report())
+    print(replayer.game_manager.map_loader.maps.report())
+    if max_resident_maps is not None:
+        diverged = replayer.compare_residency(max_resident_maps)
+        if diverged is None:
+            print('Same states with all maps in memory and with at most {0} of them'.format(max_resident_maps))
+        else:
+            print('States with all maps in memory and with at most {0} of them differ after turn {1}'.format(
+                max_resident_maps, diverged))
+            matched = False
+    sys.exit(0 if matched else 1)
@@ -0,0 +1,100 @@
+"""
+Texture atlas and shared texture cache for tile and sprite images.
+All the game images are tiny PNGs. Loaded separately, each of them is a separate GPU texture, and drawing a map
+means switching textures for nearly every tile. At startup TextureCache packs them into a single texture and
+hands out regions of it, so every widget and batched layer that draws these images uses the same texture.
+The packing is done in memory, so there is no build step and no dependencies besides kivy.
+"""
+
+from kivy.core.image import Image as CoreImage
+from kivy.graphics.texture import Texture
+
+
+class TextureCache(object):
+    """
+    Shared cache of textures, keyed by image filename.
+    Images packed by self.build_atlas() are returned as atlas regions, everything else is loaded on first
+    request and cached as a standalone texture.
+    """
+    def __init__(self):
+        self.textures = {}
+        self.atlas = None
+
+    @staticmethod
+    def _pack(sizes, atlas_size, padding):
+        """
+        Shelf-pack rectangles into a square of a given size.
+        Returns a dict of {index: (x, y)} or None if rectangles don't fit
+        :param sizes: list of (width, height)
+        :param atlas_size: int
+        :param padding: int. Empty pixels around every rectangle, so that regions don't bleed into each other
+        :return:
+        """
+        positions = {}
+        x = y = shelf_height = 0
+        for index in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+            width = sizes[index][0] + padding * 2
+            height = sizes[index][1] + padding * 2
+            if x + width > atlas_size:
+                #  Start a new shelf
+                x = 0
+                y += shelf_height
+                shelf_height = 0
+            if x + width > atlas_size or y + height > atlas_size:
+                return None
+            positions[index] = (x + padding, y + padding)
+            x += width
+            shelf_height = max(shelf_height, height)
+        return positions
+
+    def build_atlas(self, sources, padding=2, max_size=2048):
+        """
+        Pack images into a single texture.
+        Requires a GL context, ie should be called after the window is created. The images are read back as RGBA
+        via Texture.pixels, which is exact for images with on/off transparency (and all game images are such).
+        :param sources: iterable of image filenames
+        :param padding: int
+        :param max_size: int. Maximum atlas side. If images don't fit, the atlas is not built
+        :return: bool. True if the atlas was built
+        """
+        sources = [x for x in sources if x not in self.textures]
+        images = [CoreImage(x).texture for x in sources]
+        sizes = [x.size for x in images]
+        atlas_size = 256
+        positions = self._pack(sizes, atlas_size, padding)
+        while positions is None and atlas_size < max_size:
+            atlas_size *= 2
+            positions = self._pack(sizes, atlas_size, padding)
+        if positions is None:
+            return False
+        self.atlas = Texture.create(size=(atlas_size, atlas_size), colorfmt='rgba')
+        #  Nearest filtering keeps pixel art crisp and doesn't sample neighbouring regions
+        self.atlas.mag_filter = 'nearest'
+        self.atlas.min_filter = 'nearest'
+        for index, source in enumerate(sources):
+            x, y = positions[index]
+            self.atlas.blit_buffer(images[index].pixels, pos=(x, y), size=sizes[index],
+                                   colorfmt='rgba', bufferfmt='ubyte')
+            region = self.atlas.get_region(x, y, sizes[index][0], sizes[index][1])
+            #  Pixels are copied in upload order, so the region must be flipped the same way the image was
+            if images[index].uvsize[1] < 0:
+                region.flip_vertical()
+            self.textures[source] = region
+        return True
+
+    def get_texture(self, source):
+        """
+        Return the texture for a given image
+        :param source: str. Image filename
+        :return: Texture or TextureRegion
+        """
+        try:
+            return self.textures[source]
+        except KeyError:
+            texture = CoreImage(source).texture
+            self.textures[source] = texture
+            return texture
+
+
+#  The cache shared by all widgets
+texture_cache = TextureCache()
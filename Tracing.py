@@ -0,0 +1,114 @@
+"""
+Timeline tracing in Chrome trace format.
+The module-level `tracer` collects spans from turn processing, event dispatch, animation and key handling.
+The result can be exported as JSON and opened in chrome://tracing or https://ui.perfetto.dev to see
+what happened after a single keypress.
+Tracing is disabled by default; when disabled, instrumented code only checks `tracer.enabled`.
+"""
+
+import json
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter_ns
+
+
+class Tracer(object):
+    """
+    Span collector.
+    Spans are recorded as Chrome 'complete' events (ph='X'). Every span belongs to a track, which is displayed
+    as a separate thread in the viewer. Turn logic and animations run on the same thread, but animations
+    outlive the turn that started them, so they are put on their own track to keep spans properly nested.
+    """
+    tracks = {'main': 1,
+              'animation': 2}
+
+    def __init__(self, max_events=100000):
+        self.enabled = False
+        #  Oldest spans are dropped if the trace gets too long
+        self.events = deque(maxlen=max_events)
+
+    @staticmethod
+    def clock():
+        """
+        Return current time in ns
+        :return: int
+        """
+        return perf_counter_ns()
+
+    def complete(self, name, category='game', start=0, end=None, track='main', args=None):
+        """
+        Record a span.
+        :param name: str. Span name displayed on a timeline
+        :param category: str. Chrome trace category
+        :param start: int. Start time, as returned by self.clock()
+        :param end: int. End time. Defaults to now
+        :param track: str. One of self.tracks keys
+        :param args: dict. Anything JSON-serializable to be shown with the span
+        :return:
+        """
+        if end is None:
+            end = perf_counter_ns()
+        event = {'name': name,
+                 'cat': category,
+                 'ph': 'X',
+                 'ts': start / 1000,
+                 'dur': (end - start) / 1000,
+                 'pid': 1,
+                 'tid': self.tracks[track]}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def instant(self, name, category='game', track='main'):
+        """
+        Record a zero-length mark
+        :param name: str
+        :param category: str
+        :param track: str
+        :return:
+        """
+        self.events.append({'name': name,
+                            'cat': category,
+                            'ph': 'i',
+                            's': 't',
+                            'ts': perf_counter_ns() / 1000,
+                            'pid': 1,
+                            'tid': self.tracks[track]})
+
+    @contextmanager
+    def span(self, name, category='game', track='main'):
+        """
+        Context manager that records its body as a span, if tracing is enabled
+        :param name: str
+        :param category: str
+        :param track: str
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.complete(name, category=category, start=start, track=track)
+
+    def clear(self):
+        self.events.clear()
+
+    def export(self, filename):
+        """
+        Write collected spans to a Chrome trace JSON file
+        :param filename: str
+        :return:
+        """
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': track}}
+                    for track, tid in self.tracks.items()]
+        with open(filename, mode='w') as trace_file:
+            json.dump({'traceEvents': metadata + list(self.events),
+                       'displayTimeUnit': 'ms'},
+                      trace_file)
+
+
+#  The tracer used by the whole game
+tracer = Tracer()
@@ -0,0 +1,191 @@
+"""
+A lightweight tween engine for map animations.
+kivy.animation.Animation creates a few objects and a clock event per animation, which adds up when dozens of
+actors move at once. TweenEngine keeps all running tweens in preallocated slot arrays and advances them from
+a single Clock callback, which is unscheduled while there is nothing to animate. Callbacks of the tweens that
+finished during a frame are called together after all tweens were updated.
+Tweens animate two-component widget properties, such as pos, center or size.
+"""
+
+from kivy.clock import Clock
+
+
+#  Easing functions. Each takes the fraction of tween duration elapsed (0 to 1) and returns the fraction
+#  of the distance covered
+def linear(t):
+    return t
+
+
+def out_quad(t):
+    return t * (2 - t)
+
+
+def in_out_quad(t):
+    if t < 0.5:
+        return 2 * t * t
+    return -1 + (4 - 2 * t) * t
+
+
+def out_and_back(t):
+    """
+    Reach the end value in the first half of the tween and return to the start value in the second one
+    :param t:
+    :return:
+    """
+    if t < 0.5:
+        return 2 * t
+    return 2 - 2 * t
+
+
+class TweenEngine(object):
+    """
+    A set of tweens advanced by a single Clock callback.
+    Every tween occupies a slot: an index into the arrays that hold its widget, property, start and delta
+    values, start time, duration, easing and callback. Freed slots are reused, and the arrays are only grown
+    when all slots are busy.
+    """
+    def __init__(self, capacity=64):
+        self.capacity = 0
+        self._widgets = []
+        self._properties = []
+        #  Start values and deltas are stored flat, two items per slot
+        self._starts = []
+        self._deltas = []
+        self._begin_times = []
+        self._durations = []
+        self._easings = []
+        self._callbacks = []
+        #  Indices of free and running slots
+        self._free = []
+        self._active = []
+        #  Slots finished during the current frame
+        self._finished = []
+        #  Time since the engine was created, in seconds. Advanced only while something is animated
+        self.time = 0
+        self._event = None
+        self._running = False
+        self._grow(capacity)
+
+    def _grow(self, extra):
+        """
+        Add slots to the arrays
+        :param extra: int
+        :return:
+        """
+        self._widgets.extend([None] * extra)
+        self._properties.extend([None] * extra)
+        self._starts.extend([0.0] * extra * 2)
+        self._deltas.extend([0.0] * extra * 2)
+        self._begin_times.extend([0.0] * extra)
+        self._durations.extend([0.0] * extra)
+        self._easings.extend([linear] * extra)
+        self._callbacks.extend([None] * extra)
+        #  Lower slots are taken first
+        self._free.extend(range(self.capacity + extra - 1, self.capacity - 1, -1))
+        self.capacity += extra
+
+    def __len__(self):
+        return len(self._active)
+
+    def add(self, widget, prop, end, duration, easing=linear, on_complete=None):
+        """
+        Start a tween from the current value of widget's property to `end`.
+        Property is updated every frame until the duration is over; then on_complete(widget) is called
+        :param widget: Widget
+        :param prop: str. Name of a two-component property, eg 'center'
+        :param end: tuple of two numbers
+        :param duration: float. Seconds
+        :param easing: easing function, eg Tween.linear
+        :param on_complete: callable or None
+        :return:
+        """
+        if not self._free:
+            self._grow(self.capacity)
+        slot = self._free.pop()
+        start = getattr(widget, prop)
+        self._widgets[slot] = widget
+        self._properties[slot] = prop
+        self._starts[slot*2] = start[0]
+        self._starts[slot*2+1] = start[1]
+        self._deltas[slot*2] = end[0] - start[0]
+        self._deltas[slot*2+1] = end[1] - start[1]
+        self._begin_times[slot] = self.time
+        self._durations[slot] = duration
+        self._easings[slot] = easing
+        self._callbacks[slot] = on_complete
+        self._active.append(slot)
+        if not self._running:
+            self._running = True
+            if self._event:
+                self._event()
+            else:
+                self._event = Clock.schedule_interval(self._step, 0)
+
+    def finish_all(self):
+        """
+        Snap all running tweens to their end values and call their callbacks, as if they were over.
+        Tweens started by these callbacks are left running
+        :return:
+        """
+        finished = self._finished
+        for slot in self._active:
+            finished.append(slot)
+            k = self._easings[slot](1)
+            setattr(self._widgets[slot], self._properties[slot],
+                    (self._starts[slot*2] + self._deltas[slot*2] * k,
+                     self._starts[slot*2+1] + self._deltas[slot*2+1] * k))
+        del self._active[:]
+        if finished:
+            self._complete(finished)
+
+    def _step(self, dt):
+        """
+        Clock callback: advance all tweens, then call the callbacks of those that are over
+        :param dt:
+        :return: False when there is nothing left to animate, which unschedules the callback
+        """
+        self.time += dt
+        active = self._active
+        finished = self._finished
+        i = 0
+        while i < len(active):
+            slot = active[i]
+            if self._durations[slot] > 0:
+                progress = (self.time - self._begin_times[slot]) / self._durations[slot]
+            else:
+                progress = 1
+            if progress >= 1:
+                progress = 1
+                finished.append(slot)
+                #  Slot order doesn't matter, so the finished one is replaced with the last one
+                active[i] = active[-1]
+                active.pop()
+            else:
+                i += 1
+            k = self._easings[slot](progress)
+            setattr(self._widgets[slot], self._properties[slot],
+                    (self._starts[slot*2] + self._deltas[slot*2] * k,
+                     self._starts[slot*2+1] + self._deltas[slot*2+1] * k))
+        if finished:
+            self._complete(finished)
+        if not active:
+            self._running = False
+            return False
+
+    def _complete(self, finished):
+        """
+        Free the finished slots, then call their callbacks.
+        Callbacks are called only after all slots are freed, so they can start new tweens safely
+        :param finished: list of slot indices. Emptied by this method
+        :return:
+        """
+        callbacks = []
+        for slot in finished:
+            if self._callbacks[slot]:
+                callbacks.append((self._callbacks[slot], self._widgets[slot]))
+            self._widgets[slot] = None
+            self._callbacks[slot] = None
+            self._free.append(slot)
+        del finished[:]
+        for callback, widget in callbacks:
+            callback(widget)
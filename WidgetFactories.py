@@ -0,0 +1,257 @@
+"""
+Widget factories.
+Creates widgets for MapItems and for effects such as explosions and projectiles. Kept apart from Factories,
+so that the map and item factories, and the whole simulation, can be imported without kivy
+"""
+
+from kivy.graphics.context_instructions import Rotate, Translate
+from kivy.graphics.transformation import Matrix
+from kivy.uix.image import Image
+from kivy.uix.relativelayout import RelativeLayout
+from kivy.uix.scatter import Scatter
+
+#  Importing my own stuff
+from MapItem import GroundTile, MapItem
+from Actor import Actor
+from Constructions import Construction
+from Items import Item
+from TextureAtlas import texture_cache
+
+#  Other imports
+from random import choice
+
+#  I don't remember why exactly there even are three different classes for tile widgets, but I get a feeling
+#  that refactoring it will break something somewhere
+
+
+class MapItemWidget(Scatter):
+    """
+    The actor widget that contains an actor image. It's a scatter to allow scaling.
+    """
+    def __init__(self, source='PC.png', **kwargs):
+        super(MapItemWidget, self).__init__(**kwargs)
+        self.direction = 'right'
+        self.source = source
+        #  MapItem this widget currently represents
+        self.item = None
+        self.img = Image(texture=texture_cache.get_texture(source), size=(32, 32), allow_stretch=False)
+        self.add_widget(self.img)
+        self.bind(size=self.update_img)
+
+    def flip(self):
+        """
+        Flip widget horizontally
+        :return:
+        """
+        self.apply_transform(Matrix().scale(-1, 1, 1),
+                             anchor=self.center)
+        if self.direction == 'right':
+            self.direction = 'left'
+        else:
+            self.direction = 'right'
+
+    def update_img(self, a, b):
+        #  Needs to be updated manually, as Scatter does not automatically affect its children sizes
+        #  positions work out themselves, though
+        self.img.size = self.size
+
+
+class WidgetPool(object):
+    """
+    Widgets that are no longer displayed, kept for reuse.
+    Widgets are stored by key (eg image source), and at most max_size widgets are kept per key.
+    Every get() is counted as a hit or a miss
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.widgets = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return a pooled widget for a given key, or None if there are none
+        :param key:
+        :return:
+        """
+        try:
+            widget = self.widgets[key].pop()
+        except (KeyError, IndexError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return widget
+
+    def put(self, key, widget):
+        """
+        Add a widget to the pool. The widget is dropped if there are already max_size widgets for this key
+        :param key:
+        :param widget:
+        :return:
+        """
+        widgets = self.widgets.setdefault(key, [])
+        if len(widgets) < self.max_size:
+            widgets.append(widget)
+
+    def __len__(self):
+        return sum(len(x) for x in self.widgets.values())
+
+    def hit_rate(self):
+        """
+        Return the share of get() calls that returned a pooled widget
+        :return: float
+        """
+        if self.hits + self.misses == 0:
+            return 0
+        return self.hits / (self.hits + self.misses)
+
+    def report(self):
+        """
+        Return a human-readable summary of pool usage
+        :return: str
+        """
+        return 'Widget pool: {0} hits, {1} misses ({2:.1%} hit rate), {3} widgets pooled'.format(
+            self.hits, self.misses, self.hit_rate(), len(self))
+
+
+class TileWidgetFactory(object):
+    """
+    Creates widgets for MapItems and overlay widgets (explosions, projectiles and such).
+    Widgets that are no longer needed should be passed to self.recycle(); they are kept in self.pool and
+    reused for the items with the same image
+    """
+    def __init__(self):
+        # The dictionary that implements dispatching correct methods for any MapItem class
+        self.type_methods = {GroundTile: self.create_tile_widget,
+                             Actor: self.create_actor_widget,
+                             Item: self.create_item_widget,
+                             Construction: self.create_construction_widget}
+        self.passable_tiles = ('Tile_passable.png', )
+        self.pool = WidgetPool()
+
+    def create_widget(self, item):
+        """
+        Create a MapItem widget.
+        Calls the correct method of self depending on what the class of MapItem is
+        :param item:
+        :return:
+        """
+        assert isinstance(item, MapItem)
+        for t in self.type_methods.keys():
+            if isinstance(item, t):
+                return self.type_methods[t](item)
+
+    def get_image_source(self, item):
+        """
+        Return the image that should represent a MapItem.
+        Used by batched layers, which draw items without creating widgets for them
+        :param item:
+        :return:
+        """
+        if isinstance(item, GroundTile):
+            #  There is no true randomness now, because the tiles are simple white bg.
+            #  When aesthetics get implemented, some floors, underground piping, etc. will be added
+            return choice(self.passable_tiles) if item.passable else 'Tile_impassable.png'
+        return item.image_source
+
+    def release_widget(self, item):
+        """
+        Detach the widget from a MapItem that went out of view or otherwise stopped being displayed.
+        The widget goes to the pool; a widget will be taken from there if the item is shown again
+        :param item: MapItem
+        :return:
+        """
+        if item.widget:
+            self.recycle(item.widget)
+
+    def recycle(self, widget):
+        """
+        Remove a widget from its parent and put it into the pool.
+        MapItemWidgets are detached from their items and returned to the default size and direction
+        :param widget: a widget created by this factory
+        :return:
+        """
+        if widget.parent:
+            widget.parent.remove_widget(widget)
+        if isinstance(widget, MapItemWidget):
+            if widget.item and widget.item.widget is widget:
+                widget.item.widget = None
+            widget.item = None
+            if widget.direction == 'left':
+                widget.flip()
+            widget.size = (32, 32)
+        self.pool.put(widget.pool_key, widget)
+
+    def _get_map_item_widget(self, item, source, **kwargs):
+        """
+        Return a MapItemWidget for a given item, taking it from the pool if possible
+        :param item: MapItem
+        :param source: str. Image filename
+        :param kwargs: Scatter properties
+        :return:
+        """
+        widget = self.pool.get(source)
+        if widget:
+            for name, value in kwargs.items():
+                setattr(widget, name, value)
+        else:
+            widget = MapItemWidget(source=source, size=(32, 32),
+                                   size_hint=(None, None), **kwargs)
+            widget.pool_key = source
+        widget.item = item
+        item.widget = widget
+        return widget
+
+    def create_tile_widget(self, tile):
+        s = self.get_image_source(tile)
+        return self._get_map_item_widget(tile, s, do_rotation=False, do_translation=False)
+
+    #  These three methods are similar, but I'll retain three different methods in case something changes about them
+    def create_actor_widget(self, actor):
+        s = actor.image_source
+        #  Better not allow multitouch transformations
+        return self._get_map_item_widget(actor, s, do_rotation=False, do_translation=False)
+
+    def create_item_widget(self, item):
+        s = item.image_source
+        return self._get_map_item_widget(item, s, do_rotation=True, do_translation=True)
+
+    def create_construction_widget(self, constr):
+        return self._get_map_item_widget(constr, constr.image_source, do_rotation=True, do_translation=True)
+
+    def create_overlay_widget(self, source):
+        """
+        Return an image widget for effects such as explosions or shots.
+        Size and position should be set by the caller, since pooled widgets retain the old ones
+        :param source: str. Image filename
+        :return: Image
+        """
+        key = ('overlay', source)
+        widget = self.pool.get(key)
+        if not widget:
+            widget = Image(texture=texture_cache.get_texture(source), size_hint=(None, None))
+            widget.pool_key = key
+        return widget
+
+    def create_projectile_widget(self, source, angle):
+        """
+        Return a rotated projectile (eg a rocket) widget.
+        It's a 64x64 layout with a 32x32 image inside. Size and position should be set by the caller
+        :param source: str. Image filename
+        :param angle: float. Rotation, in degrees
+        :return: RelativeLayout
+        """
+        key = ('projectile', source)
+        widget = self.pool.get(key)
+        if not widget:
+            widget = RelativeLayout(size_hint=(None, None))
+            image = Image(texture=texture_cache.get_texture(source),
+                          size=(32, 32),
+                          size_hint=(None, None))
+            widget.add_widget(image)
+            widget.canvas.before.add(Translate(x=16, y=16))
+            widget.rotation = Rotate(angle=0, axis=(0, 0, 1), origin=image.center)
+            widget.canvas.before.add(widget.rotation)
+            widget.pool_key = key
+        widget.rotation.angle = angle
+        return widget
@@ -1,37 +1,92 @@
 #! /usr/bin/env python3
+#  Imported before kivy, so that the startup profile includes kivy import time
+from Profiling import startup_profiler
+
 #  Kivy imports
 import kivy
 kivy.require('1.9.0')
 from kivy.app import App
 from kivy.config import Config
-from kivy.graphics.context_instructions import Rotate, Translate
+from kivy.graphics.context_instructions import Translate, PushMatrix, PopMatrix
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.image import Image
 from kivy.uix.label import Label
-from kivy.graphics import Color, Rectangle
+from kivy.uix.stencilview import StencilView
+from kivy.uix.widget import Widget
+from kivy.graphics import Color, Rectangle, InstructionGroup
+from kivy.graphics.texture import Texture
 from kivy.core.window import Window
-from kivy.animation import Animation
 from kivy.core.audio import SoundLoader
+from kivy.clock import Clock
+startup_profiler.mark('kivy imported')
 
 #  My own stuff
-from Factories import TileWidgetFactory, MapLoader
+from Assets import AssetLoader
 from Controller import Command, PlayerController
-from GameEvent import EventDispatcher, GameEvent
+from GameEvent import GameEvent
+from GameManager import GameManager
 from Listeners import Listener, DeathListener, BorderWalkListener, TutorialListener
+from Profiling import SlowTurnWatchdog
+from Replay import SessionRecorder
+from TextureAtlas import texture_cache
+from Tracing import tracer
+from Tween import TweenEngine, out_and_back
+from WidgetFactories import TileWidgetFactory
 
 #  Others
 import sys
 import traceback
+from glob import glob
+from random import randrange
 from math import atan2, degrees
-from collections import deque
+from collections import deque, OrderedDict
+startup_profiler.mark('modules imported')
 
 #  A collection of constants. Most definitely needs to be refactored into a proper option container
 
 #  If set, this Dijkstra map will be shown as overlay. Set to something that doesn't evaluate to True to disable
-#  Dijkstra display altogether. To avoid creating a new event type, this is redrawn at the end of every turn.
+#  Dijkstra display altogether. To avoid creating a new event type, this is updated at the end of every turn.
 DISPLAY_DIJKSTRA_MAP = None
 
+#  If set, the session (seed and PC commands) is saved to this file on exit and can be replayed with Replay.py
+RECORD_SESSION_FILE = None
+#  Master seed for random streams. If None and the session is recorded, a random seed is chosen
+SESSION_SEED = None
+
+#  Chrome trace file. Tracing is toggled with 't' key, and the trace is written here when it's switched off
+TRACE_FILE = 'camp_trace.json'
+
+#  If set, turns that take longer than this many milliseconds are saved to SLOW_TURN_DIR for investigation
+SLOW_TURN_BUDGET_MS = None
+SLOW_TURN_DIR = 'slow_turns'
+
+#  If set to (width, height) in cells, the map is shown through a camera of this size that scrolls with PC.
+#  Only the cells within the camera view and VIEWPORT_MARGIN cells around it have widgets, so the rendering
+#  cost doesn't depend on map size. If None, the entire map is shown
+VIEWPORT_SIZE = None
+VIEWPORT_MARGIN = 2
+#  The camera is recentered on PC when PC comes within this many cells of the view edge
+VIEWPORT_SCROLL_MARGIN = 3
+
+#  Maximum duration of a single turn's animation, in seconds. Animations of longer turns are sped up.
+#  Set to None to play animations at the normal speed no matter how long it takes
+MAX_TURN_ANIMATION = 1.0
+
+#  Maximum number of keypresses waiting to be processed
+INPUT_BUFFER_SIZE = 4
+
+#  Number of recently visited maps whose widgets are kept, so that returning to them is instant
+MAP_WIDGET_CACHE_SIZE = 4
+
+#  If set, only this many recently visited maps are kept in memory, and the rest are saved to disk until PC
+#  returns to them. Widgets are only cached for the maps in memory
+MAX_RESIDENT_MAPS = None
+
+#  Startup profile (time to the first frame and to all assets loaded) is printed when the assets are loaded.
+#  If this is set, it is also appended to this file as a JSON line
+STARTUP_PROFILE_FILE = None
+
 
 class KeyParser(object):
     """
@@ -95,106 +150,6 @@ class KeyParser(object):
         return Command(command_type=self.command_types[keycode[1]], command_value=self.command_values[keycode[1]])
 
 
-class GameManager():
-    """
-    A singleton game manager. It holds data about current map, GameEvent queue and so on.
-    Basically anything that is neither interface nor is limited to a single map/actor belongs here
-    """
-    def __init__(self, map_file='test_level.lvl'):
-        self.queue = EventDispatcher()
-        self.map_loader = MapLoader()
-        self.map_loader.read_map_file(map_file)
-        self.map = None
-        self.game_widget = None
-        #  Log list. Initial values allow not to have empty log at the startup
-        self.game_log = []
-
-    def _load_map(self, map_id='start'):
-        """
-        Load a new map with a given ID.
-        Doesn't do anything to widgets: just loads the map and connects the queue. The first map loaded is
-        drawn by GameWidget's __init__(), for others you should call self.switch_map(), not this method
-        :param map_id: str
-        :return: Map
-        """
-        self.map = self.map_loader.get_map_by_id(map_id)
-        self.map.register_manager(self)
-        return self.map
-
-    def switch_map(self, map_id='empty', entrance_direction=None):
-        """
-        Switch to a new map.
-        Assumes the map is available from self.map_loader. The queue is cleaned up because otherwise
-        some animations on non-displayed items are run after switch. PC, if any, is retained
-        :param map_id:
-        :return:
-        """
-        self.queue.clear()
-        pc = None
-        if self.map:
-            pc = self.map.actors[0]
-            self.map.delete_item(layer='actors', location=pc.location)
-        self._load_map(map_id)
-        if len(self.map.entrance_message) > 0:
-            self.map.extend_log(self.map.entrance_message)
-        if pc:  # pc is None only for the first map loaded just after starting the app
-            if entrance_direction == 'north':
-                pc.location = [pc.location[0], self.map.size[1]-1]
-            elif entrance_direction == 'south':
-                pc.location = [pc.location[0], 0]
-            elif entrance_direction == 'west':
-                pc.location = [self.map.size[0]-1, pc.location[1]]
-            elif entrance_direction == 'east':
-                pc.location = [0, pc.location[1]]
-            else:
-                raise ValueError('Only one of north, south, west or east is accepted as entrance_direction')
-            #  There may be zero actors on the map, if there are no enemies and (wrong) PC was removed upon load
-            if len(self.map.actors) >= 1 and isinstance(self.map.actors[0].controller, PlayerController):
-                self.map.delete_item(layer='actors', location=self.map.actors[0].location)
-            self.map.add_item(item=pc, layer='actors', location=pc.location)
-            self.game_widget.rebuild_map_widget()
-        else:
-            #  These events are necessary to initialize UI
-            self.queue.append(GameEvent(event_type='hp_changed',
-                                        actor=self.map.actors[0]))
-            self.queue.append(GameEvent(event_type='inventory_updated',
-                                        actor=self.map.actors[0]))
-
-    def process_events(self):
-        """
-        Process all events in a queue
-        :return:
-        """
-        self.queue.pass_all_events()
-
-    def register_listener(self, listener):
-        """
-        Add a queue listener to both queue and self.
-        Listeners registered here get their game_manager attribute set to self. It can allow them to interact
-        with the game, ordering GameManager to change levels, finish the game and so on. This widget also gets
-        access to the entire game information via self.map and self.queue.
-        Thus, it's advised to use this method only for listeners that need to do so; achievement trackers,
-        whatever else *views* the game should be registered to queue directly.
-        :param listener:
-        :return:
-        """
-        self.queue.register_listener(listener)
-        listener.game_manager = self
-
-    def register_widget(self, widget):
-        """
-        Introduce yourself to a widget that will need to refer to this object's data.
-        This is meant for widgets that need access to game data, but do not need to read queue. For example,
-        inventory widget needs to know what's in PC's pockets, but doesn't need access to the event queue. It is
-        told to update by RLMapWidget when its time comes. Unless absolutely necessary, it's better to avoid
-        subscribing widgets to queue and thus having their process_game_event called for everything that happened
-        in the game world.
-        :param widget:
-        :return:
-        """
-        widget.game_manager = self
-
-
 class GameWidget(RelativeLayout):
     """
     Main game widget. Includes map, as well as various other widgets, as children.
@@ -203,23 +158,26 @@ class GameWidget(RelativeLayout):
     def __init__(self, game_manager=None, **kwargs):
         super(GameWidget, self).__init__(**kwargs)
         #  Widget-related stuff
+        self.tile_factory = TileWidgetFactory()
         self.map_widget = None
+        #  StencilView that clips the map widget
+        self.map_view = None
+        #  Map widgets of recently visited maps, by map ID, least recently used first
+        self.map_widget_cache = OrderedDict()
         self.log_widget = None
         self.status_widget = None
         #  Connecting to manager
         self.game_manager = game_manager
         self.game_manager.game_widget = self
         self.rebuild_widgets()
-        #  Sound object
-        self.boombox = {'moved': SoundLoader.load('dshoof.wav'),
-                        'attacked': SoundLoader.load('dspunch.wav'),
-                        'exploded': SoundLoader.load('dsbarexp.wav'),
-                        'shot': SoundLoader.load('dspistol.wav')}
-        #  Sound in kivy seems to be loaded lazily. Files are not actually read until they are necessary,
-        #  which leads to lags for up to half a second when a sound is used for the first time. The following
-        #  two lines are forcing them to be loaded right now.
-        for sound in self.boombox.keys():
-            self.boombox[sound].seek(0)
+        #  Sounds are loaded after the first frame (see CampApp.on_start()); until then, the game is silent
+        self.assets = AssetLoader()
+        self.boombox = self.assets.assets
+        for name, source in (('moved', 'dshoof.wav'),
+                             ('attacked', 'dspunch.wav'),
+                             ('exploded', 'dsbarexp.wav'),
+                             ('shot', 'dspistol.wav')):
+            self.assets.add(name, lambda source=source: self.load_sound(source))
         #  Keyboard controls
         #  Initializing keyboard bindings and key lists
         self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
@@ -241,6 +199,8 @@ class GameWidget(RelativeLayout):
                              'g', ',', 'd', 'i',
                              #  Targeted effects
                              'z', 'x', 'f',
+                             #  Turn profiler and tracer
+                             'p', 't',
                              #  Others
                              'escape', 'enter', 'numpadenter']
         #  Keys in this list are processed by self.map_widget.map
@@ -252,6 +212,8 @@ class GameWidget(RelativeLayout):
                          'numpad6', 'numpad7', 'numpad8', 'numpad9',
                          'g', ',']
         self.key_parser = KeyParser()
+        #  Keys waiting to be processed
+        self.input_buffer = deque()
         #  Game state
         self.game_state = 'playing'
         #  Stuff for various game states
@@ -259,6 +221,32 @@ class GameWidget(RelativeLayout):
         self.target_coordinates = (None, None)
         self.targeted_item_number = None
 
+    @staticmethod
+    def load_sound(source):
+        """
+        Load a sound file
+        :param source: str
+        :return: Sound or None if it cannot be loaded
+        """
+        sound = SoundLoader.load(source)
+        #  Sound in kivy seems to be loaded lazily. Files are not actually read until they are necessary,
+        #  which leads to lags for up to half a second when a sound is used for the first time. Seeking
+        #  forces it to be loaded right now.
+        if sound:
+            sound.seek(0)
+        return sound
+
+    def play_sound(self, name):
+        """
+        Play a sound from self.boombox from the beginning. Does nothing if the sound is not loaded (yet)
+        :param name: str
+        :return:
+        """
+        sound = self.boombox.get(name)
+        if sound:
+            sound.seek(0)
+            sound.play()
+
     def rebuild_widgets(self):
         """
         Rebuild all the widgets according to map in self.game_manager.
@@ -268,13 +256,19 @@ class GameWidget(RelativeLayout):
         """
         if self.map_widget:
             self.game_manager.queue.unregister_listener(self.map_widget)
-            self.remove_widget(self.map_widget)
+            self.remove_widget(self.map_view)
         #  Initializing widgets
         self.map_widget = RLMapWidget(map=self.game_manager.map,
-                                      size=(self.game_manager.map.size[0]*32,
-                                            self.game_manager.map.size[1]*32),
+                                      game_widget=self,
+                                      view_size=VIEWPORT_SIZE,
+                                      tile_factory=self.tile_factory,
                                       size_hint=(None, None),
                                       pos=(0, 100))
+        #  Map widget is clipped, so that the cells around camera view are not drawn over other widgets
+        self.map_view = StencilView(pos=self.map_widget.pos,
+                                    size=self.map_widget.size,
+                                    size_hint=(None, None))
+        self.map_view.add_widget(self.map_widget)
         self.log_widget = LogWindow(id='log_window',
                                     text='\n'.join(self.game_manager.game_log[-3:]),
                                     size=(self.map_widget.width+150, 100),
@@ -291,7 +285,7 @@ class GameWidget(RelativeLayout):
                                           size_hint=(None, None))
         self.height = self.map_widget.height+self.log_widget.height
         self.width = self.map_widget.width+self.status_widget.width
-        self.add_widget(self.map_widget)
+        self.add_widget(self.map_view)
         self.add_widget(self.log_widget)
         self.add_widget(self.status_widget)
         #  Registering MapWidget to receive events from GameManager
@@ -302,27 +296,88 @@ class GameWidget(RelativeLayout):
 
     def rebuild_map_widget(self):
         """
-        Rebuild the map widget, leaving others as they are
+        Replace the map widget with the one for the current map, leaving others as they are.
+        Map widgets of recently visited maps are kept in self.map_widget_cache, so returning to such a map
+        only reattaches its widget and brings it up to date with the map
         :return:
         """
         self.game_manager.queue.unregister_listener(self.map_widget)
-        self.remove_widget(self.map_widget)
-        self.map_widget = RLMapWidget(map=self.game_manager.map,
-                                      size=(self.game_manager.map.size[0]*32,
-                                            self.game_manager.map.size[1]*32),
-                                      size_hint=(None, None),
-                                      pos=(0, 100))
-        self.add_widget(self.map_widget)
+        self.map_view.remove_widget(self.map_widget)
+        self.map_widget.detach()
+        if self.map_widget.map.map_id is not None:
+            self.map_widget_cache[self.map_widget.map.map_id] = self.map_widget
+        map = self.game_manager.map
+        cached = self.map_widget_cache.pop(map.map_id, None)
+        if cached and cached.map is map:
+            self.map_widget = cached
+            self.map_widget.resync()
+        else:
+            if cached:
+                #  The map was reloaded since its widget was cached
+                cached.release_widgets()
+            self.map_widget = RLMapWidget(map=map,
+                                          game_widget=self,
+                                          view_size=VIEWPORT_SIZE,
+                                          tile_factory=self.tile_factory,
+                                          size_hint=(None, None),
+                                          pos=(0, 100))
+        while len(self.map_widget_cache) > MAP_WIDGET_CACHE_SIZE:
+            self.map_widget_cache.popitem(last=False)[1].release_widgets()
+        #  Widgets of evicted maps would keep them in memory, and couldn't be reused anyway
+        maps = self.game_manager.map_loader.maps
+        for map_id in [x for x in self.map_widget_cache if not maps.is_resident(x)]:
+            self.map_widget_cache.pop(map_id).release_widgets()
+        self.map_view.size = self.map_widget.size
+        self.map_view.add_widget(self.map_widget)
         self.game_manager.queue.register_listener(self.map_widget)
 
     def _on_key_down(self, keyboard, keycode, text, modifier):
         """
-        Process a single keypress
+        Buffer a single keypress and process it as soon as possible.
+        If the previous turn is still being animated, its animation is fast-forwarded, so the game responds
+        immediately no matter how long the animations are. Keys pressed when the buffer is full are dropped
         :param keycode:
         :param text:
         :param modifier:
         :return:
         """
+        if keycode[1] not in self.allowed_keys:
+            return
+        if len(self.input_buffer) < INPUT_BUFFER_SIZE:
+            self.input_buffer.append(keycode)
+        if self.map_widget.animating:
+            self.map_widget.fast_forward()
+        self.process_input_buffer()
+
+    def process_input_buffer(self):
+        """
+        Process buffered keys until one of them starts an animation.
+        Every key is recorded as a trace span if tracing is enabled
+        :return:
+        """
+        while self.input_buffer and not self.map_widget.animating:
+            keycode = self.input_buffer.popleft()
+            if tracer.enabled:
+                with tracer.span('key {0}'.format(keycode[1]), category='input'):
+                    self._process_key(keycode)
+            else:
+                self._process_key(keycode)
+
+    def animation_finished(self):
+        """
+        Called by the map widget when a turn animation is over. Keys left in the buffer are processed on
+        the next frame, so that a key is never processed from within animation callbacks
+        :return:
+        """
+        if self.input_buffer:
+            Clock.schedule_once(lambda dt: self.process_input_buffer())
+
+    def _process_key(self, keycode):
+        """
+        Process a single keypress
+        :param keycode:
+        :return:
+        """
         #  Do nothing if animation is still running
         if self.map_widget.animating:
             return
@@ -333,9 +388,27 @@ class GameWidget(RelativeLayout):
                 if keycode[1] in self.map_keys:
                     #  If the key is a 'map-controlling' one, ie uses a turn without calling further windows
                     command = self.key_parser.key_to_command(keycode)
-                    self.game_manager.map.process_turn(command=command)
+                    self.game_manager.process_turn(command=command)
                 elif keycode[1] == 'escape':
                     App.get_running_app().stop()
+                elif keycode[1] == 'p':
+                    #  Toggle turn profiling. Stats are printed to console when it's switched off
+                    if self.game_manager.profiler.toggle():
+                        self.game_manager.profiler.stats.clear()
+                        print('Turn profiler enabled')
+                    else:
+                        print(self.game_manager.profiler.stats.report())
+                        print(self.tile_factory.pool.report())
+                        print(self.game_manager.map_loader.maps.report())
+                elif keycode[1] == 't':
+                    #  Toggle tracing. Trace is exported when it's switched off
+                    tracer.enabled = not tracer.enabled
+                    if tracer.enabled:
+                        tracer.clear()
+                        print('Tracing enabled')
+                    else:
+                        tracer.export(TRACE_FILE)
+                        print('Trace written to {0}'.format(TRACE_FILE))
                 #  The following checks set various game states but don't, by themselves, produce commands
                 elif keycode[1] in 'c':
                     #  Displaying player stats window
@@ -356,7 +429,7 @@ class GameWidget(RelativeLayout):
                 elif keycode[1] in 'z':
                     self.game_state = 'jump_targeting'
                     self.target_coordinates = self.map_widget.map.actors[0].location
-                    self.state_widget = Image(source='JumpTarget.png',
+                    self.state_widget = Image(texture=texture_cache.get_texture('JumpTarget.png'),
                                               pos=self.map_widget.get_screen_pos(self.target_coordinates,
                                                                                  parent=True),
                                               size=(32, 32),
@@ -365,7 +438,7 @@ class GameWidget(RelativeLayout):
                 elif keycode[1] in 'x':
                     self.game_state = 'examine_targeting'
                     self.target_coordinates = self.map_widget.map.actors[0].location
-                    self.state_widget = Image(source='ExamineTarget.png',
+                    self.state_widget = Image(texture=texture_cache.get_texture('ExamineTarget.png'),
                                               pos=self.map_widget.get_screen_pos(self.target_coordinates,
                                                                                  parent=True),
                                               size=(32, 32),
@@ -374,7 +447,7 @@ class GameWidget(RelativeLayout):
                 elif keycode[1] in 'f':
                     self.game_state = 'fire_targeting'
                     self.target_coordinates = self.map_widget.map.actors[0].location
-                    self.state_widget = Image(source='FireTarget.png',
+                    self.state_widget = Image(texture=texture_cache.get_texture('FireTarget.png'),
                                               pos=self.map_widget.get_screen_pos(self.target_coordinates,
                                                                                    parent=True),
                                               size=(32, 32),
@@ -387,11 +460,11 @@ class GameWidget(RelativeLayout):
                         if not item.effect.require_targeting:
                             command = Command(command_type='use_item',
                                               command_value=(self.key_parser.key_to_number(keycode), ))
-                            self.game_manager.map.process_turn(command=command)
+                            self.game_manager.process_turn(command=command)
                         else:
                             self.game_state = 'item_targeting'
                             self.target_coordinates = self.game_manager.map.actors[0].location
-                            self.state_widget = Image(source='FireTarget.png',
+                            self.state_widget = Image(texture=texture_cache.get_texture('FireTarget.png'),
                                                       pos=self.map_widget.get_screen_pos(self.target_coordinates,
                                                                                          parent=True),
                                                       size=(32, 32),
@@ -415,7 +488,7 @@ class GameWidget(RelativeLayout):
                         #  Remove inventory widget upon using item
                         self.remove_widget(self.state_widget)
                         self.game_state = 'playing'
-                        self.game_manager.map.process_turn(command=command)
+                        self.game_manager.process_turn(command=command)
                     except ValueError:
                         pass
                 elif 'targeting' in self.game_state:
@@ -426,7 +499,7 @@ class GameWidget(RelativeLayout):
                         command = Command(command_type='jump', command_value=delta)
                         self.game_state = 'playing'
                         self.remove_widget(self.state_widget)
-                        self.game_manager.map.process_turn(command=command)
+                        self.game_manager.process_turn(command=command)
                     elif self.game_state == 'examine_targeting' and keycode[1] in ('x', 'enter', 'numpadenter'):
                         #  Examine whatever is under cursor
                         self.game_state = 'examine_window'
@@ -453,7 +526,7 @@ class GameWidget(RelativeLayout):
                             #  Shooting at someone else is okay
                             command = Command(command_type='shoot',
                                               command_value=self.target_coordinates)
-                            self.game_manager.map.process_turn(command)
+                            self.game_manager.process_turn(command)
                     elif self.game_state == 'item_targeting' and keycode[1] in ('enter', 'numpadenter'):
                         #  Apply item to the nearest collidable tile towards the cursor
                         hit_coordinates = self.game_manager.map.get_line(
@@ -465,7 +538,7 @@ class GameWidget(RelativeLayout):
                                                          hit_coordinates[1]))
                         self.game_state = 'playing'
                         self.remove_widget(self.state_widget)
-                        self.game_manager.map.process_turn(command)
+                        self.game_manager.process_turn(command)
                     elif keycode[1] in self.key_parser.command_types.keys() and \
                                     self.key_parser.command_types[keycode[1]] == 'walk':
                         #  Move the targeting widget
@@ -502,6 +575,8 @@ class LayerWidget(RelativeLayout):
     """
     A map layer widget.
     Displays a single layer of a map: items, or actors, or bg, or something.
+    Only the items within the visible area of the map widget get widgets. The area is set by
+    self.show_area(), which is called by the map widget after creation and whenever the camera moves.
     Depends on its parent having the following attributes:
     self.parent.map  a Map instance with a layer corresponding to this widget
     tile_factory  a TileWidgetFactory instance
@@ -513,42 +588,277 @@ class LayerWidget(RelativeLayout):
         #  When the widget is in use, it'll be self.parent, but the widget cannot be attached before
         #  it is constructed
         self.size = parent.size
-        #  Initializing tile widgets
-        for x in range(parent.map.size[0]):
-            for y in range(parent.map.size[1]):
-                item = parent.map.get_item(layer=self.layer, location=(x, y))
+        self.tile_factory = parent.tile_factory
+
+    def show_area(self, map_widget, area):
+        """
+        Show the items within a given area, releasing the widgets of items outside it
+        :param map_widget: RLMapWidget
+        :param area: int tuple (x0, y0, x1, y1), as in RLMapWidget.visible_area
+        :return:
+        """
+        items = {}
+        for x in range(area[0], area[2]):
+            for y in range(area[1], area[3]):
+                item = map_widget.map.get_item(layer=self.layer, location=(x, y))
                 if item:
-                    tile_widget = parent.tile_factory.create_widget(item)
-                    tile_widget.center = parent.get_screen_pos((x, y), center=True)
-                    self.add_widget(tile_widget)
+                    items[item] = (x, y)
+        self.show_widgets(map_widget, items)
 
+    def show_widgets(self, map_widget, items):
+        """
+        Make sure that the given items, and only them, have widgets in this layer, and place those widgets
+        according to the current camera position
+        :param map_widget: RLMapWidget
+        :param items: dict of {MapItem: location}
+        :return:
+        """
+        for widget in self.children[:]:
+            if widget.item not in items:
+                self.remove_widget(widget)
+                self.tile_factory.release_widget(widget.item)
+        for item, location in items.items():
+            if not item.widget:
+                self.tile_factory.create_widget(item)
+            if item.widget.parent is not self:
+                #  The widget may still be attached to the map widget of another map (eg PC's one)
+                if item.widget.parent:
+                    item.widget.parent.remove_widget(item.widget)
+                self.add_widget(item.widget)
+            item.widget.center = map_widget.get_screen_pos(location, center=True)
+
+    def refresh_cells(self, map_widget, cells):
+        """
+        Bring the given cells up to date with the map. Rescans the whole visible area if any of them is visible
+        :param map_widget: RLMapWidget
+        :param cells: iterable of int tuples
+        :return:
+        """
+        if any(map_widget.is_visible(x) for x in cells):
+            self.show_area(map_widget, map_widget.visible_area)
 
-class DijkstraWidget(RelativeLayout):
+    def release_widgets(self):
+        """
+        Put all widgets of this layer into the factory pool
+        :return:
+        """
+        for widget in self.children[:]:
+            self.tile_factory.recycle(widget)
+
+
+class BatchedLayerWidget(LayerWidget):
+    """
+    A map layer widget for layers that rarely change ('bg' and 'constructions').
+    Instead of a widget per cell, static items are drawn as textured Rectangles in this widget's canvas, one
+    InstructionGroup per texture. Items are static if they have no controller: they never move or attack, so
+    they never need to be animated. Items with controllers (eg towers) get regular widgets, which are added
+    as children and thus drawn on top of the batch.
+    Rectangles are placed in map coordinates, and the whole batch is shifted according to camera position.
+    Rectangles of cells that leave the visible area are reused for the cells that enter it.
+    Cells are updated in place via self.add_item() and self.remove_item().
+    Depends on its parent having the same attributes as LayerWidget does
     """
-    The widget that displays little numbers on every tile to allow debugging Dijkstra maps.
+    def __init__(self, layer='layer', parent=None, **kwargs):
+        super(BatchedLayerWidget, self).__init__(layer=layer, parent=parent, **kwargs)
+        #  The group is added before any child widget, so the children are drawn over it
+        self.batch = InstructionGroup()
+        self.offset = Translate()
+        self.canvas.add(PushMatrix())
+        self.canvas.add(self.offset)
+        self.canvas.add(self.batch)
+        self.canvas.add(PopMatrix())
+        #  {image source: (InstructionGroup, texture)}
+        self.groups = {}
+        #  {location: (Rectangle, image source, item)} and {item: location} for items that aren't shared
+        self.cells = {}
+        self.item_locations = {}
+        #  Rectangles removed from the batch, to be reused
+        self.spare_rects = []
+
+    def show_area(self, map_widget, area):
+        """
+        Show the items within a given area, dropping the cells outside it.
+        Cells that don't match the map (eg because the map has changed while its widget was cached) are redrawn
+        :param map_widget: RLMapWidget
+        :param area: int tuple (x0, y0, x1, y1)
+        :return:
+        """
+        for location in [x for x in self.cells if not map_widget.is_visible(x)]:
+            self.clear_cell(location)
+        widget_items = {}
+        for x in range(area[0], area[2]):
+            for y in range(area[1], area[3]):
+                item = map_widget.map.get_item(layer=self.layer, location=(x, y))
+                cell = self.cells.get((x, y))
+                if item and self.accepts(item):
+                    if not cell or cell[2] is not item:
+                        self.add_item(item, (x, y))
+                    continue
+                if cell:
+                    self.clear_cell((x, y))
+                if item:
+                    widget_items[item] = (x, y)
+        self.show_widgets(map_widget, widget_items)
+        self.offset.xy = (-map_widget.camera[0]*32, -map_widget.camera[1]*32)
+
+    def refresh_cells(self, map_widget, cells):
+        """
+        Bring the given cells up to date with the map, redrawing only them.
+        Cells that have (or may have had) a widget instead of a batched rectangle make it fall back to rescanning
+        the whole visible area, because LayerWidget.show_widgets() needs all the widget items at once
+        :param map_widget: RLMapWidget
+        :param cells: iterable of int tuples
+        :return:
+        """
+        for location in cells:
+            if not map_widget.is_visible(location):
+                continue
+            item = map_widget.map.get_item(layer=self.layer, location=location)
+            if item and self.accepts(item):
+                cell = self.cells.get(location)
+                if not cell or cell[2] is not item:
+                    self.add_item(item, location)
+            elif item or location not in self.cells:
+                self.show_area(map_widget, map_widget.visible_area)
+                return
+            else:
+                self.clear_cell(location)
+
+    @staticmethod
+    def accepts(item):
+        """
+        Return True if the item can be drawn as a part of the batch
+        :param item: MapItem
+        :return:
+        """
+        return getattr(item, 'controller', None) is None
+
+    def _get_group(self, source):
+        """
+        Return the instruction group and the texture for a given image, creating them if necessary
+        :param source: str
+        :return:
+        """
+        try:
+            return self.groups[source]
+        except KeyError:
+            group = InstructionGroup()
+            self.batch.add(group)
+            self.groups[source] = (group, texture_cache.get_texture(source))
+            return self.groups[source]
+
+    def add_item(self, item, location):
+        """
+        Draw item at a given cell, replacing whatever was drawn there
+        :param item: MapItem
+        :param location: int tuple
+        :return:
+        """
+        location = tuple(location)
+        self.clear_cell(location)
+        source = self.tile_factory.get_image_source(item)
+        group, texture = self._get_group(source)
+        if self.spare_rects:
+            rect = self.spare_rects.pop()
+            rect.texture = texture
+            rect.pos = (location[0]*32, location[1]*32)
+        else:
+            rect = Rectangle(texture=texture, size=(32, 32), pos=(location[0]*32, location[1]*32))
+        group.add(rect)
+        self.cells[location] = (rect, source, item)
+        #  Shared items are in many cells at once, and they are never removed by events anyway
+        if not item.shared:
+            self.item_locations[item] = location
+
+    def remove_item(self, item):
+        """
+        Stop drawing an item. Returns False if the item wasn't drawn by this layer
+        :param item: MapItem
+        :return: bool
+        """
+        try:
+            location = self.item_locations.pop(item)
+        except KeyError:
+            return False
+        self.clear_cell(location)
+        return True
+
+    def clear_cell(self, location):
+        """
+        Remove whatever is drawn at a given cell
+        :param location: int tuple
+        :return:
+        """
+        try:
+            rect, source, item = self.cells.pop(location)
+        except KeyError:
+            return
+        self.groups[source][0].remove(rect)
+        self.spare_rects.append(rect)
+        self.item_locations.pop(item, None)
+
+
+class DijkstraWidget(Widget):
+    """
+    Debugging overlay that shows a Dijkstra map as a heatmap: attractors are red, distant cells are blue,
+    cells that cannot be reached are grey and ignored ones are not coloured.
+    The whole map is a single texture with a pixel per cell, stretched over the map. After every update only
+    the columns that have changed are uploaded, so the overlay is cheap enough to be left on.
     This widget is designed to be a child of RLMapWidget, so it relies on its methods
-    For such a crude testing thing I won't even write updating: let's just remove it and create
-    anew every time Dijkstra map is updated. Therefore it's immensely laggy and performance of anything
-    should be tested with it disabled.
     """
-    def __init__(self, parent = None, **kwargs):
+    #  Cells this far from an attractor or further get the coldest colour
+    max_value = 30
+
+    def __init__(self, parent=None, dijkstra_map=None, **kwargs):
         super(DijkstraWidget, self).__init__(**kwargs)
-        for x in range(parent.map.size[0]):
-            for y in range(parent.map.size[1]):
-                self.add_widget(Label(size=(64, 64),
-                                      size_hint=(None, None),
-                                      pos=parent.get_screen_pos((x, y)),
-                                      text=str(parent.map.dijkstras[DISPLAY_DIJKSTRA_MAP][x][y]),
-                                      text_size=(64, 64),
-                                      font_size=7,
-                                      color=(0, 0, 0, 1)))
+        self.dijkstra_map = dijkstra_map
+        self.texture = Texture.create(size=parent.map.size, colorfmt='rgba')
+        self.texture.mag_filter = 'nearest'
+        #  Values as of the last upload, a list of columns
+        self.values = [[] for x in range(parent.map.size[0])]
+        self.palette = [bytes((int(255*(1 - x/self.max_value)), 0, int(255*x/self.max_value), 110))
+                        for x in range(self.max_value + 1)]
+        self.rect = Rectangle(texture=self.texture,
+                              size=(parent.map.size[0]*32, parent.map.size[1]*32))
+        self.canvas.add(self.rect)
+        self.update(parent)
+
+    def _get_colour(self, value):
+        """
+        Return RGBA bytes for a Dijkstra map value
+        :param value: int or None
+        :return: bytes
+        """
+        if value is None:
+            return b'\x00\x00\x00\x00'
+        if value >= 1000:
+            #  Unreachable from any attractor
+            return b'\x80\x80\x80\x50'
+        return self.palette[max(0, min(value, self.max_value))]
+
+    def update(self, map_widget):
+        """
+        Upload the columns that have changed since the last update and follow the camera
+        :param map_widget: RLMapWidget
+        :return:
+        """
+        self.rect.pos = map_widget.get_screen_pos((0, 0))
+        for x, column in enumerate(self.dijkstra_map):
+            if column != self.values[x]:
+                self.texture.blit_buffer(b''.join(self._get_colour(value) for value in column),
+                                         pos=(x, 0), size=(1, len(column)),
+                                         colorfmt='rgba', bufferfmt='ubyte')
+                self.values[x] = list(column)
 
 
 class RLMapWidget(RelativeLayout, Listener):
     """
     Game map widget. Mostly is busy displaying character widgets and such.
-    Assumes that its parent has the following attributes:
-    self.parent.boombox  a dict of SoundLoader instances with correct sounds
+    If view_size is smaller than the map, the widget shows only view_size cells starting from self.camera,
+    and only the items within self.visible_area get widgets. All screen positions are calculated by
+    self.get_screen_pos(), which takes the camera into account.
+    Assumes that game_widget has the following attributes:
+    game_widget.play_sound()  plays sounds by name
     """
     #  A list of events that should be ignored by the animation system
     #  'queue_exhausted' is not included here as self.process_game_event() processes it separately
@@ -556,29 +866,63 @@ class RLMapWidget(RelativeLayout, Listener):
                     'inventory_updated',
                     'hp_changed',
                     'ammo_changed'}
+    #  Layers that are drawn with BatchedLayerWidget
+    batched_layers = ('bg', 'constructions')
+    #  Duration of a basic animation, in seconds
+    anim_duration = 0.2
+    #  Durations of event animations relative to the basic one. Events not listed here take 1
+    event_durations = {'exploded': 3,
+                       'picked_up': 0,
+                       'dropped': 0,
+                       'actor_spawned': 0,
+                       'construction_spawned': 0}
 
-    def __init__(self, map=None, **kwargs):
+    def __init__(self, map=None, game_widget=None, view_size=None, tile_factory=None, **kwargs):
         super(RLMapWidget, self).__init__(**kwargs)
         #  Connecting to map, factories and other objects this class should know about
-        self.tile_factory = TileWidgetFactory()
+        #  The factory is shared between map widgets, so that they use the same widget pool
+        self.tile_factory = tile_factory or TileWidgetFactory()
         self.map = map
-        self.size = [self.map.size[0]*32, self.map.size[1]*32]
-        #  Adding LayerWidgets for every layer of the map
+        self.game_widget = game_widget
+        #  Camera: the bottom-left cell shown and the number of cells shown
+        self.camera = (0, 0)
+        if view_size:
+            self.view_size = (min(view_size[0], self.map.size[0]), min(view_size[1], self.map.size[1]))
+        else:
+            self.view_size = tuple(self.map.size)
+        #  Cells that have widgets: (x0, y0, x1, y1), upper bounds excluded
+        self.visible_area = (0, 0, 0, 0)
+        self.size = [self.view_size[0]*32, self.view_size[1]*32]
+        #  Adding LayerWidgets for every layer of the map. Static layers are drawn in batches
         self.layer_widgets = {}
         for layer in self.map.layers:
-            self.layer_widgets.update({layer: LayerWidget(layer=layer, parent=self)})
+            if layer in self.batched_layers:
+                self.layer_widgets.update({layer: BatchedLayerWidget(layer=layer, parent=self)})
+            else:
+                self.layer_widgets.update({layer: LayerWidget(layer=layer, parent=self)})
             self.add_widget(self.layer_widgets[layer])
+        #  Debugging Dijkstra map view. Created at the end of constructor, so that it's drawn over the layers
+        self.dijkstra_widget = None
+        self.reset_camera()
         #  This is set to True during animation to avoid mistakes
         self.animating = False
         #  Queue of GameEvents to be animated
         self.animation_queue = []
+        #  Phases waiting to be played: (animated events, non-animated events, basic animation duration)
+        self.phases = deque()
+        #  Non-animated events of the current phase and the number of its animations still running
+        self.phase_non_animated = []
+        self.pending_animations = 0
         #  A temporary widget slot for stuff like explosions, spell effects and such
         self.overlay_widget = None
+        #  All map animations are run by this engine
+        self.tweens = TweenEngine()
+        #  Number of events and start time of the animation phase currently running, if it's traced
+        self._traced_phase = None
         #  Debugging Dijkstra map view
         if DISPLAY_DIJKSTRA_MAP:
-            self.dijkstra_widget = None
-            # self.dijkstra_widget = DijkstraWidget(parent=self)
-            # self.add_widget(self.dijkstra_widget)
+            self.dijkstra_widget = DijkstraWidget(parent=self, dijkstra_map=self.map.dijkstras[DISPLAY_DIJKSTRA_MAP])
+            self.add_widget(self.dijkstra_widget)
         self.counter = 0
 
 
@@ -595,168 +939,250 @@ class RLMapWidget(RelativeLayout, Listener):
         """
         if event.event_type == 'queue_exhausted':
             #  Shoot animations only after the entire event batch for the turn has arrived
-            #  Better to avoid multiple methods messing with self.animation_queue simultaneously
-            self.animate_game_event()
-        #  Ignore non-animatable events
+            phases = self.split_phases(self.animation_queue)
+            self.animation_queue = []
+            #  Animations are sped up if the turn would take too long otherwise
+            duration = self.anim_duration
+            total = duration * sum(max((self.event_durations.get(x.event_type, 1) for x in animated), default=0)
+                                   for animated, non_animated in phases)
+            if MAX_TURN_ANIMATION and total > MAX_TURN_ANIMATION:
+                duration *= MAX_TURN_ANIMATION/total
+            self.phases.extend((animated, non_animated, duration) for animated, non_animated in phases)
+            if not self.animating:
+                self.start_next_phase()
         else:
             self.animation_queue.append(event)
 
-    def animate_game_event(self, widget=None, anim_duration=0.2):
+    def split_phases(self, events):
         """
-        Process a single event from self.animation_queue
-        Read the event and perform the correct actions on widgets (such as update text of log window,
-        create and launch animation, maybe make some sound). The event is removed from self.map.game_events.
-        After the actions required are performed, the method calls itself again, either recursively, or, in
-        case of animations, via Animation's on_complete argument. The recursion is broken when event queue is
-        empty.
-        :return:
+        Split the events of a turn into phases that are played one after another.
+        Events within a phase are played simultaneously. An event goes to the phase after the last one that
+        involves the same actor or location, so the order is kept where it matters (eg an attack and the
+        destruction of its target), while independent events (eg moves of different actors) are played
+        together. Non-animated events are processed at the end of the phase of the last event they depend on.
+        :param events: list of GameEvent
+        :return: list of (animated events, non-animated events)
         """
-        if widget and widget.parent and widget.height == 0:
-            #  If the widget was given zero size, this means it should be removed
-            #  This entire affair is kinda inefficient and should be rebuilt later
-            widget.parent.remove_widget(widget)
-        if not self.animation_queue == []:
-            event = self.animation_queue.pop(0)
-            if event.event_type == 'moved':
-                final = self.get_screen_pos(event.actor.location, center=True)
-                if final[0] < event.actor.widget.pos[0] and event.actor.widget.direction == 'right'\
-                        or final[0] > event.actor.widget.pos[0] and event.actor.widget.direction == 'left':
-                    event.actor.widget.flip()
-                a = Animation(center=final, duration=anim_duration)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                a.start(event.actor.widget)
-            elif event.event_type == 'attacked':
-                current = self.get_screen_pos(event.actor.location, center=True)
-                target = self.get_screen_pos(event.location, center=True)
-                if target[0] > current[0] and event.actor.widget.direction == 'left' or\
-                        target[0] < current[0] and event.actor.widget.direction == 'right':
-                    event.actor.widget.flip()
-                a = Animation(center_x=current[0]+int((target[0]-current[0])/2),
-                              center_y=current[1]+int((target[1]-current[1])/2),
-                              duration=anim_duration/2)
-                a += Animation(center_x=current[0], center_y=current[1], duration=anim_duration/2)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                a.start(event.actor.widget)
-                self.parent.boombox['attacked'].seek(0)
-                self.parent.boombox['attacked'].play()
-            elif event.event_type == 'was_destroyed':
-                if not event.actor.widget:
-                    #  If actor is None, that means it was destroyed right after spawning, not getting a
-                    #  widget. Similar case is covered under 'dropped', see there for example. The check is
-                    #  different here, because in 'dropped' item is taken from map, where it's None by the time
-                    #  this method runs. Here, on the other hand, Item object exists (in GameEvent), but has
-                    #  no widget (and is not placed on map, but that's irrelevant).
-                    self.animate_game_event()
-                    return
-                a = Animation(size=(0, 0), duration=anim_duration)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                a.start(event.actor.widget)
-            elif event.event_type == 'picked_up':
-                #  It's assumed that newly added item will be the last in player inventory
-                self.layer_widgets['items'].remove_widget(self.map.actors[0].inventory[-1].widget)
-                self.animate_game_event()
-            elif event.event_type == 'dropped':
-                item = self.map.get_item(location=event.location, layer='items')
-                if not item:
-                    #  Item could've been destroyed right after being drop, ie it didn't get a widget. Skip.
-                    #  It's rather likely if someone was killed by landmine, dropped an item and had this item
-                    #  destroyed in the same explosion
-                    self.animate_game_event()
-                    return
-                if not item.widget:
-                    self.tile_factory.create_widget(item)
-                    item.widget.center = self.get_screen_pos(event.location, center=True)
-                self.layer_widgets['items'].add_widget(item.widget)
-                self.animate_game_event()
-            elif event.event_type == 'actor_spawned':
-                if not event.actor.widget:
-                    self.tile_factory.create_widget(event.actor)
-                event.actor.widget.center = self.get_screen_pos(event.location, center=True)
-                self.layer_widgets['actors'].add_widget(event.actor.widget)
-                self.animate_game_event()
-            elif event.event_type == 'construction_spawned':
-                if not event.actor.widget:
-                    self.tile_factory.create_widget(event.actor)
-                event.actor.widget.center = self.get_screen_pos(event.location, center=True)
-                self.layer_widgets['constructions'].add_widget(event.actor.widget)
-                self.animate_game_event()
-            elif event.event_type == 'exploded':
-                loc = self.get_screen_pos(event.location)
-                loc = (loc[0]+16, loc[1]+16)
-                self.overlay_widget = Image(source='Explosion.png',
-                                            size=(0, 0),
-                                            size_hint=(None, None),
-                                            pos=loc)
-                a = Animation(size=(96, 96), pos=(loc[0]-32, loc[1]-32),
-                              duration=0.3)
-                a += Animation(size=(0, 0), pos=loc,
-                               duration=0.3)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                self.add_widget(self.overlay_widget)
-                self.parent.boombox['exploded'].seek(0)
-                self.parent.boombox['exploded'].play()
-                a.start(self.overlay_widget)
-            elif event.event_type == 'rocket_shot':
-                self.overlay_widget = RelativeLayout(center=self.get_screen_pos(event.actor.location, center=True),
-                                                     size=(64,64),
-                                                     size_hint=(None, None))
-                i = Image(source='Rocket.png',
-                          size=(32, 32),
-                          size_hint=(None, None))
-                self.overlay_widget.add_widget(i)
-                self.overlay_widget.canvas.before.add(Translate(x=16, y=16))
-                a = degrees(atan2(event.actor.location[1]-event.location[1],
-                                  event.actor.location[0]-event.location[0]))
-                # if abs(a) >= 90:
-                #     self.overlay_widget.center_y += 64
-                self.overlay_widget.canvas.before.add(Rotate(angle=a+90, axis=(0, 0, 1),
-                                                             origin=i.center))
-                a = Animation(center=self.get_screen_pos(event.location, center=True), duration=anim_duration)
-                a += Animation(size=(0, 0), duration=0)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                self.add_widget(self.overlay_widget)
-                a.start(self.overlay_widget)
-            elif event.event_type == 'shot':
-                self.overlay_widget = Image(source='Shot.png',
-                                            size=(32, 32),
-                                            size_hint=(None, None),
-                                            pos=self.get_screen_pos(event.actor.location))
-                a = Animation(pos=self.get_screen_pos(event.location), duration=anim_duration)
-                a += Animation(size=(0, 0), duration=0)
-                a.bind(on_start=lambda x, y: self.remember_anim(),
-                       on_complete=lambda x, y: self.animate_game_event(widget=y))
-                self.add_widget(self.overlay_widget)
-                self.parent.boombox['shot'].seek(0)
-                self.parent.boombox['shot'].play()
-                a.start(self.overlay_widget)
-            elif event.event_type in self.non_animated:
-                self.parent.process_nonmap_event(event)
-                self.animate_game_event()
+        phases = []
+        #  {actor or location: the last phase involving it}
+        last_phase = {}
+        previous = -1
+        for event in events:
+            keys = []
+            if event.actor:
+                keys.append(event.actor)
+            if getattr(event, 'location', None) is not None:
+                keys.append(tuple(event.location))
+            if keys:
+                depends = max(last_phase.get(x, -1) for x in keys)
+            else:
+                #  Events unrelated to any actor or location (eg log updates) follow whatever preceded them
+                depends = previous
+            if event.event_type in self.non_animated:
+                phase = max(depends, 0)
+            else:
+                phase = depends + 1
+            while len(phases) <= phase:
+                phases.append(([], []))
+            phases[phase][1 if event.event_type in self.non_animated else 0].append(event)
+            for key in keys:
+                last_phase[key] = phase
+            previous = phase
+        return phases
 
-        else:
+    def start_next_phase(self):
+        """
+        Start all animations of the next phase from self.phases.
+        When there are no phases left, the turn animation is over and keyboard is reactivated
+        :return:
+        """
+        if self._traced_phase:
+            tracer.complete('phase', category='animation', start=self._traced_phase[1],
+                            track='animation', args={'events': self._traced_phase[0]})
+            self._traced_phase = None
+        if not self.phases:
             #  Reactivating keyboard after finishing animation
             self.animating = False
-            #  Might as well be time to redraw the Dijkstra widget
-            if DISPLAY_DIJKSTRA_MAP:
-                if self.dijkstra_widget:
-                    self.remove_widget(self.dijkstra_widget)
-                # else:
-                #     self.map.dijkstras['PC'].rebuild_self()
-                self.dijkstra_widget = DijkstraWidget(parent=self)
-                self.add_widget(self.dijkstra_widget)
-
-    def remember_anim(self):
-        '''
-        This is a separate method because lambdas cannot into assignment, and animation queue
-         depends on lambdas not to be evaluated prematurely.
-        :return:
-        '''
+            self.follow_pc()
+            if tracer.enabled:
+                tracer.instant('animation finished', category='animation', track='animation')
+            #  Might as well be time to update the Dijkstra widget
+            if self.dijkstra_widget:
+                self.dijkstra_widget.update(self)
+            if self.game_widget:
+                self.game_widget.animation_finished()
+            return
         self.animating = True
+        animated, self.phase_non_animated, duration = self.phases.popleft()
+        if tracer.enabled:
+            self._traced_phase = (len(animated), tracer.clock())
+        #  One extra count, so that the phase doesn't end before all of its animations are started
+        self.pending_animations = len(animated) + 1
+        for event in animated:
+            self.animate_game_event(event, anim_duration=duration)
+        self.finish_animation()
+
+    def finish_animation(self, widget=None):
+        """
+        Called when a single event of the current phase was animated. The last one ends the phase
+        :param widget: the widget that was animated, if any
+        :return:
+        """
+        if widget and widget.parent and widget.height == 0:
+            #  If the widget was given zero size, this means it should be removed
+            self.tile_factory.recycle(widget)
+        self.pending_animations -= 1
+        if self.pending_animations == 0:
+            for event in self.phase_non_animated:
+                self.game_widget.process_nonmap_event(event)
+            self.start_next_phase()
+
+    def fast_forward(self):
+        """
+        Finish the turn animation right away, snapping all widgets to their final state
+        :return:
+        """
+        while self.animating and len(self.tweens):
+            self.tweens.finish_all()
+
+    def finish_overlay(self, widget):
+        """
+        Remove an overlay widget (eg a projectile) that has reached its target
+        :param widget:
+        :return:
+        """
+        widget.size = (0, 0)
+        self.finish_animation(widget=widget)
+
+    def animate_game_event(self, event, anim_duration=0.2):
+        """
+        Start animating a single event.
+        Read the event and perform the correct actions on widgets (create and launch animation, maybe make
+        some sound). When the animation is over (or right away, for events that only add or remove widgets),
+        self.finish_animation() is called.
+        :param event: GameEvent
+        :param anim_duration: float. Duration of a basic animation, such as a single move
+        :return:
+        """
+        if event.event_type == 'moved':
+            if not event.actor.widget:
+                #  The actor was outside the visible area. If it has entered it, it's just placed there
+                if self.is_visible(event.actor.location):
+                    self.tile_factory.create_widget(event.actor)
+                    event.actor.widget.center = self.get_screen_pos(event.actor.location, center=True)
+                    self.layer_widgets[event.actor.layer].add_widget(event.actor.widget)
+                self.finish_animation()
+                return
+            final = self.get_screen_pos(event.actor.location, center=True)
+            if final[0] < event.actor.widget.pos[0] and event.actor.widget.direction == 'right'\
+                    or final[0] > event.actor.widget.pos[0] and event.actor.widget.direction == 'left':
+                event.actor.widget.flip()
+            self.tweens.add(event.actor.widget, 'center', final, anim_duration,
+                            on_complete=self.finish_animation)
+        elif event.event_type == 'attacked':
+            if not event.actor.widget:
+                #  Attacks outside the visible area are not shown
+                self.finish_animation()
+                return
+            current = self.get_screen_pos(event.actor.location, center=True)
+            target = self.get_screen_pos(event.location, center=True)
+            if target[0] > current[0] and event.actor.widget.direction == 'left' or\
+                    target[0] < current[0] and event.actor.widget.direction == 'right':
+                event.actor.widget.flip()
+            #  Halfway to the target and back
+            self.tweens.add(event.actor.widget, 'center',
+                            (current[0]+int((target[0]-current[0])/2), current[1]+int((target[1]-current[1])/2)),
+                            anim_duration, easing=out_and_back, on_complete=self.finish_animation)
+            self.game_widget.play_sound('attacked')
+        elif event.event_type == 'was_destroyed':
+            if self.layer_widgets['constructions'].remove_item(event.actor):
+                #  Batched constructions just disappear
+                self.finish_animation()
+                return
+            if not event.actor.widget:
+                #  If actor is None, that means it was destroyed right after spawning, not getting a
+                #  widget. Similar case is covered under 'dropped', see there for example. The check is
+                #  different here, because in 'dropped' item is taken from map, where it's None by the time
+                #  this method runs. Here, on the other hand, Item object exists (in GameEvent), but has
+                #  no widget (and is not placed on map, but that's irrelevant).
+                self.finish_animation()
+                return
+            self.tweens.add(event.actor.widget, 'size', (0, 0), anim_duration,
+                            on_complete=self.finish_animation)
+        elif event.event_type == 'picked_up':
+            #  It's assumed that newly added item will be the last in player inventory
+            self.tile_factory.release_widget(self.map.actors[0].inventory[-1])
+            self.finish_animation()
+        elif event.event_type == 'dropped':
+            item = self.map.get_item(location=event.location, layer='items')
+            if not item or not self.is_visible(event.location):
+                #  Item could've been destroyed right after being drop, ie it didn't get a widget. Skip.
+                #  It's rather likely if someone was killed by landmine, dropped an item and had this item
+                #  destroyed in the same explosion
+                self.finish_animation()
+                return
+            if not item.widget:
+                self.tile_factory.create_widget(item)
+                item.widget.center = self.get_screen_pos(event.location, center=True)
+            self.layer_widgets['items'].add_widget(item.widget)
+            self.finish_animation()
+        elif event.event_type == 'actor_spawned':
+            if not self.is_visible(event.location):
+                self.finish_animation()
+                return
+            if not event.actor.widget:
+                self.tile_factory.create_widget(event.actor)
+            event.actor.widget.center = self.get_screen_pos(event.location, center=True)
+            self.layer_widgets['actors'].add_widget(event.actor.widget)
+            self.finish_animation()
+        elif event.event_type == 'construction_spawned':
+            if not self.is_visible(event.location):
+                self.finish_animation()
+                return
+            if self.layer_widgets['constructions'].accepts(event.actor):
+                self.layer_widgets['constructions'].add_item(event.actor, event.location)
+                self.finish_animation()
+                return
+            if not event.actor.widget:
+                self.tile_factory.create_widget(event.actor)
+            event.actor.widget.center = self.get_screen_pos(event.location, center=True)
+            self.layer_widgets['constructions'].add_widget(event.actor.widget)
+            self.finish_animation()
+        elif event.event_type in ('shot', 'rocket_shot', 'exploded') and\
+                not self.is_visible(event.location) and\
+                not (event.actor and self.is_visible(event.actor.location)):
+            #  Neither end of the effect is visible
+            self.finish_animation()
+        elif event.event_type == 'exploded':
+            loc = self.get_screen_pos(event.location)
+            loc = (loc[0]+16, loc[1]+16)
+            self.overlay_widget = self.tile_factory.create_overlay_widget('Explosion.png')
+            self.overlay_widget.size = (0, 0)
+            self.overlay_widget.pos = loc
+            #  Grows and shrinks back to zero size, which removes it
+            self.tweens.add(self.overlay_widget, 'pos', (loc[0]-32, loc[1]-32), anim_duration*3,
+                            easing=out_and_back)
+            self.tweens.add(self.overlay_widget, 'size', (96, 96), anim_duration*3,
+                            easing=out_and_back, on_complete=self.finish_animation)
+            self.add_widget(self.overlay_widget)
+            self.game_widget.play_sound('exploded')
+        elif event.event_type == 'rocket_shot':
+            a = degrees(atan2(event.actor.location[1]-event.location[1],
+                              event.actor.location[0]-event.location[0]))
+            self.overlay_widget = self.tile_factory.create_projectile_widget('Rocket.png', angle=a+90)
+            self.overlay_widget.size = (64, 64)
+            self.overlay_widget.center = self.get_screen_pos(event.actor.location, center=True)
+            self.tweens.add(self.overlay_widget, 'center', self.get_screen_pos(event.location, center=True),
+                            anim_duration, on_complete=self.finish_overlay)
+            self.add_widget(self.overlay_widget)
+        elif event.event_type == 'shot':
+            self.overlay_widget = self.tile_factory.create_overlay_widget('Shot.png')
+            self.overlay_widget.size = (32, 32)
+            self.overlay_widget.pos = self.get_screen_pos(event.actor.location)
+            self.tweens.add(self.overlay_widget, 'pos', self.get_screen_pos(event.location), anim_duration,
+                            on_complete=self.finish_overlay)
+            self.add_widget(self.overlay_widget)
+            self.game_widget.play_sound('shot')
 
     def get_screen_pos(self, location, parent=False, center=False):
         """
@@ -767,7 +1193,7 @@ class RLMapWidget(RelativeLayout, Listener):
         :param center: bool. If True, return coordinates for tile center, otherwise return bottom-left corner
         :return: int tuple
         """
-        r = [location[0]*32, location[1]*32]
+        r = [(location[0]-self.camera[0])*32, (location[1]-self.camera[1])*32]
         if center:
             r[0] += 16
             r[1] += 16
@@ -776,6 +1202,110 @@ class RLMapWidget(RelativeLayout, Listener):
         else:
             return self.to_parent(r[0], r[1])
 
+    def is_visible(self, location):
+        """
+        Return True if a given location is within self.visible_area
+        :param location: int tuple
+        :return: bool
+        """
+        return self.visible_area[0] <= location[0] < self.visible_area[2] and\
+            self.visible_area[1] <= location[1] < self.visible_area[3]
+
+    def get_camera_for(self, location):
+        """
+        Return the camera position that centers the view on a given location, without going beyond map borders
+        :param location: int tuple
+        :return: int tuple
+        """
+        return tuple(max(0, min(self.map.size[i]-self.view_size[i], location[i]-self.view_size[i]//2))
+                     for i in (0, 1))
+
+    def move_camera(self, camera):
+        """
+        Move the camera and show the items in the new visible area.
+        Widgets of the items that went out of view are released, so their number is limited by view size
+        :param camera: int tuple. Bottom-left cell of the view
+        :return:
+        """
+        self.camera = tuple(camera)
+        self.visible_area = (max(0, self.camera[0]-VIEWPORT_MARGIN),
+                             max(0, self.camera[1]-VIEWPORT_MARGIN),
+                             min(self.map.size[0], self.camera[0]+self.view_size[0]+VIEWPORT_MARGIN),
+                             min(self.map.size[1], self.camera[1]+self.view_size[1]+VIEWPORT_MARGIN))
+        for layer in self.map.layers:
+            self.layer_widgets[layer].show_area(self, self.visible_area)
+        if self.dijkstra_widget:
+            self.dijkstra_widget.update(self)
+
+    def reset_camera(self):
+        """
+        Center the camera on PC and show everything around it
+        :return:
+        """
+        if self.map.actors:
+            self.move_camera(self.get_camera_for(self.map.actors[0].location))
+        else:
+            self.move_camera((0, 0))
+
+    def detach(self):
+        """
+        Prepare the widget to be cached while another map is shown.
+        Running animations are finished, and the events that were not animated yet are dropped
+        :return:
+        """
+        self.fast_forward()
+        self.animation_queue = []
+        self.phases.clear()
+        self.animating = False
+        #  From now on the map remembers what changes while the widget is cached, for self.resync()
+        self.map.track_dirty_cells()
+        self.map.consume_dirty_cells()
+
+    def resync(self):
+        """
+        Bring a cached widget up to date with its map after it was attached again.
+        If the camera stays where it was, only the cells changed since self.detach() are redrawn
+        :return:
+        """
+        dirty_cells = self.map.consume_dirty_cells()
+        camera = self.get_camera_for(self.map.actors[0].location) if self.map.actors else (0, 0)
+        if camera != self.camera:
+            self.move_camera(camera)
+            return
+        for layer, cells in dirty_cells.items():
+            if cells:
+                self.layer_widgets[layer].refresh_cells(self, cells)
+        if self.dijkstra_widget:
+            self.dijkstra_widget.update(self)
+
+    def release_widgets(self):
+        """
+        Put all widgets of this map widget into the factory pool. Called when the widget is dropped from cache
+        :return:
+        """
+        for layer in self.layer_widgets.values():
+            layer.release_widgets()
+
+    def follow_pc(self):
+        """
+        Recenter the camera if PC came too close to the view edge. Called after every turn's animation.
+        Actors that walked out of the visible area lose their widgets
+        :return:
+        """
+        if self.view_size == tuple(self.map.size) or not self.map.actors:
+            #  The entire map is shown
+            return
+        location = self.map.actors[0].location
+        camera = self.camera
+        for i in (0, 1):
+            if location[i]-self.camera[i] < VIEWPORT_SCROLL_MARGIN or\
+                    self.camera[i]+self.view_size[i]-1-location[i] < VIEWPORT_SCROLL_MARGIN:
+                camera = self.get_camera_for(location)
+        if camera != self.camera:
+            self.move_camera(camera)
+        else:
+            self.layer_widgets['actors'].show_area(self, self.visible_area)
+
     def update_rect(self, pos, size):
         self.rect.pos = self.pos
         self.rect.size = self.size
@@ -925,7 +1455,7 @@ class InventoryItemWidget(RelativeLayout):
     """
     def __init__(self, number, *args, **kwargs):
         super(InventoryItemWidget, self).__init__(*args, **kwargs)
-        self.bg_image = Image(source='Inv_box.png', size=(64, 64))
+        self.bg_image = Image(texture=texture_cache.get_texture('Inv_box.png'), size=(64, 64))
         self.add_widget(self.bg_image)
         self.item_image = None  # Things will be drawn here
         self.number = number  # Will come handy when those will be buttons
@@ -946,7 +1476,7 @@ class InventoryItemWidget(RelativeLayout):
         """
         if self.item_image:
             self.remove_widget(self.item_image)
-        self.item_image = Image(source=item.image_source, size=(64, 64))
+        self.item_image = Image(texture=texture_cache.get_texture(item.image_source), size=(64, 64))
         self.add_widget(self.item_image)
 
     def remove_item(self):
@@ -970,8 +1500,24 @@ class CampApp(App):
 
     def build(self):
         root = BoxLayout(orientation='vertical')
-        self.game_manager = GameManager(map_file='test_level.lvl')
+        #  All images are packed into a single texture before any widget is created
+        texture_cache.build_atlas(sorted(glob('*.png')))
+        startup_profiler.mark('atlas built')
+        seed = SESSION_SEED
+        if RECORD_SESSION_FILE and seed is None:
+            seed = randrange(2**32)
+        self.game_manager = GameManager(map_file='test_level.lvl', seed=seed, thread_safe_queue=True,
+                                        max_resident_maps=MAX_RESIDENT_MAPS)
+        #  Events posted by background threads are delivered on the next frame
+        self.game_manager.queue.schedule_delivery = lambda callback: Clock.schedule_once(lambda dt: callback())
         self.game_manager.switch_map('entrance')
+        startup_profiler.mark('map loaded')
+        if RECORD_SESSION_FILE:
+            self.game_manager.recorder = SessionRecorder(game_manager=self.game_manager,
+                                                         start_map='entrance')
+        if SLOW_TURN_BUDGET_MS:
+            self.game_manager.watchdog = SlowTurnWatchdog(budget_ms=SLOW_TURN_BUDGET_MS,
+                                                          output_dir=SLOW_TURN_DIR)
         self.game_widget = GameWidget(game_manager=self.game_manager,
                                       size=Window.size,
                                       size_hint=(None, None),
@@ -984,8 +1530,32 @@ class CampApp(App):
         root.add_widget(self.game_widget)
         #  Some events were shot during map loading to initialize display.
         self.game_manager.queue.pass_all_events()
+        startup_profiler.mark('widgets built')
         return root
 
+    def on_start(self):
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, *args):
+        """
+        Called when the first frame is shown. Starts loading the assets that weren't necessary to draw it
+        :return:
+        """
+        Window.unbind(on_flip=self.on_first_frame)
+        startup_profiler.mark('first frame')
+        self.game_widget.assets.start(on_ready=self.on_assets_loaded)
+
+    @staticmethod
+    def on_assets_loaded(loader):
+        startup_profiler.mark('assets loaded')
+        print(startup_profiler.report())
+        if STARTUP_PROFILE_FILE:
+            startup_profiler.save(STARTUP_PROFILE_FILE)
+
+    def on_stop(self):
+        if self.game_manager.recorder:
+            self.game_manager.recorder.save(RECORD_SESSION_FILE)
+
 if __name__ == '__main__':
     Config.set('kivy', 'exit_on_escape', 0)
     try: